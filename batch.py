@@ -0,0 +1,242 @@
+"""
+Batch conversion machinery shared by nbconvert.py and rst2ipynb.py.
+
+Both scripts convert many files in one go, serially or in a pool of worker
+processes, keep going when some of them fail, and report on the run:
+
+def convert_one(task):
+    infile = task
+    start = time.time()
+    converted, error = batch.trap(convert, infile)
+    return infile, error, time.time() - start, converted
+
+summary = batch.run(convert_one, tasks, jobs=4)
+batch.print_summary(summary)
+
+A failure in one file is logged and recorded in the summary, but doesn't
+stop the conversion of the others.
+
+The caches of the scripts live in subdirectories of the directory given as
+--cache-dir, see `open_cache`, so that they can share one.
+"""
+from __future__ import print_function
+
+import errno
+import glob
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+
+from cache import ContentCache, content_key
+
+
+def makedirs(path):
+    """Create the directory path and its parents, unless it exists."""
+    if path and not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+def expand_paths(paths, extensions, skip_dirs=()):
+    """Expand a list of files, glob patterns and directories into files.
+
+    Directories are walked recursively for files ending with one of
+    extensions, skipping the subdirectories named in skip_dirs, glob
+    patterns are expanded and plain files are kept as given.
+
+    Returns a list of (fname, name) pairs, where name is the path of the
+    file relative to the directory it was found in, or its base name
+    otherwise.  The list is free of duplicates and keeps the order in which
+    the paths were given, each directory or glob being sorted.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            fnames = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = [d for d in dirnames if d not in skip_dirs]
+                fnames.extend(os.path.join(dirpath, fname)
+                              for fname in filenames
+                              if fname.endswith(extensions))
+            found.extend((fname, os.path.relpath(fname, path))
+                         for fname in sorted(fnames))
+        elif glob.has_magic(path):
+            found.extend((fname, os.path.basename(fname))
+                         for fname in sorted(glob.glob(path)))
+        else:
+            found.append((path, os.path.basename(path)))
+    seen = set()
+    return [(f, name) for f, name in found if not (f in seen or seen.add(f))]
+
+
+class OutputCollision(SystemExit):
+    """Several files would be converted to the same output file."""
+
+
+def output_collisions(tasks):
+    """Return the files of tasks, a list of (infile, outfile) pairs, which
+    would be converted to the same file, as a dict mapping each such outfile
+    to the list of its infiles."""
+    infiles = {}
+    for infile, outfile in tasks:
+        key = os.path.abspath(outfile)
+        infiles.setdefault(key, (outfile, []))[1].append(infile)
+    return dict((outfile, names) for outfile, names in infiles.values()
+                if len(names) > 1)
+
+
+def check_outputs(tasks):
+    """Refuse to convert files which would overwrite each other's output,
+    such as x/index.ipynb and y/index.ipynb written to the same directory.
+
+    tasks is a list of (infile, outfile) pairs.  Raises OutputCollision, a
+    SystemExit listing the colliding files."""
+    collisions = output_collisions(tasks)
+    if collisions:
+        raise OutputCollision(
+            'These files would be converted to the same file:\n' +
+            '\n'.join('  %s: %s' % (outfile, ', '.join(names))
+                      for outfile, names in sorted(collisions.items())))
+
+
+def cache_path(cache_dir, name):
+    """Return the directory of the cache called name in cache_dir, or None
+    (for a cache kept in memory) if cache_dir is None."""
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, name)
+
+
+def open_cache(cache_dir, name, **kwargs):
+    """Return the ContentCache called name in cache_dir, see `cache_path`.
+    Keyword arguments are passed on to ContentCache."""
+    return ContentCache(cache_path(cache_dir, name), **kwargs)
+
+
+def get_cached(cache, key):
+    """Return the data cached under key by `set_cached`, if the files it was
+    made from haven't changed since, or None."""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    # The files and their digests, on the first line
+    dependencies, data = entry.split('\n', 1)
+    for fname, digest in json.loads(dependencies):
+        try:
+            with open(fname, 'rb') as f:
+                if content_key(f.read()) != digest:
+                    return None
+        except IOError:
+            return None
+    return data
+
+
+def set_cached(cache, key, data, dependencies):
+    """Cache data under key, along with the digests of the files in
+    dependencies, which it was made from."""
+    digests = []
+    for fname in dependencies:
+        with open(fname, 'rb') as f:
+            digests.append((fname, content_key(f.read())))
+    cache.set(key, json.dumps(digests) + '\n' + data)
+
+
+def trap(func, *args, **kwargs):
+    """Call func(*args, **kwargs), returning (result, error).
+
+    error is None, or the formatted traceback of the exception func raised,
+    in which case result is None.  SystemExit, which docutils raises on
+    errors, is trapped too."""
+    try:
+        return func(*args, **kwargs), None
+    except (Exception, SystemExit):
+        return None, traceback.format_exc()
+
+
+def run(convert_one, tasks, jobs=1, initializer=None, initargs=(),
+        unchanged='skipped', on_result=None):
+    """Call convert_one on each of tasks, with a pool of worker processes.
+
+    Parameters
+    ----------
+    convert_one : function
+      Called with each task, in this process or in a worker, so it and the
+      tasks must be picklable.  It must not raise (see `trap`), and returns
+      a tuple (infile, error, seconds, converted, ...), error being None or
+      a traceback and converted False when the output was up to date.
+    jobs : int
+      Number of worker processes.  With 1 (the default) the tasks are
+      done serially in this process; 0 or None means one worker per CPU.
+    initializer, initargs
+      Called as initializer(*initargs) in each worker, or once in this
+      process when the tasks are done serially.
+    unchanged : string
+      Key of the summary listing the files which weren't converted because
+      they were up to date.
+    on_result : function
+      Called with the tuple returned for each task, as it comes.
+
+    Returns
+    -------
+    summary : dict
+      With keys 'succeeded' (list of files), 'failed' (list of (file,
+      traceback) pairs), unchanged (list of the succeeded files which were
+      up to date) and 'wall_time' (in seconds).
+    """
+    import multiprocessing
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(tasks)) or 1
+
+    summary = {'succeeded': [], 'failed': [], unchanged: [], 'wall_time': 0.0}
+    start = time.time()
+    if jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        results = (convert_one(task) for task in tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs, initializer, initargs)
+        results = pool.imap_unordered(convert_one, tasks)
+    try:
+        for result in results:
+            infile, error, seconds, converted = result[:4]
+            if on_result is not None:
+                on_result(result)
+            if error is None:
+                if converted:
+                    logging.info('Converted %s in %.2fs' % (infile, seconds))
+                else:
+                    summary[unchanged].append(infile)
+                summary['succeeded'].append(infile)
+            else:
+                logging.error('Failed to convert %s:\n%s' % (infile, error))
+                summary['failed'].append((infile, error))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    summary['wall_time'] = time.time() - start
+    return summary
+
+
+def print_summary(summary, stream=None, what='files', unchanged='skipped',
+                  unchanged_label='up to date'):
+    """Print a short report of a `run`, whose files are described as what,
+    and the unchanged ones as unchanged_label."""
+    if stream is None:
+        stream = sys.stdout
+    nok, nfail = len(summary['succeeded']), len(summary['failed'])
+    nunchanged = len(summary.get(unchanged, []))
+    print('Converted %i of %i %s in %.2fs (%i failed, %i %s)'
+          % (nok, nok + nfail, what, summary['wall_time'], nfail, nunchanged,
+             unchanged_label), file=stream)
+    for infile, error in summary['failed']:
+        print('  FAILED: %s: %s' % (infile, error.strip().splitlines()[-1]),
+              file=stream)
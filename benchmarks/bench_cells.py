@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Benchmark the per-cell overhead of the converters.
+
+Builds a notebook with many small cells, so that the time goes to the
+conversion machinery (method lookups, dispatching on cell and output types)
+rather than to rendering any single cell, and prints the time per cell for
+the converters which don't need external tools.  With --compare REV, the
+same measurement is also made with the nbconvert of that git revision.
+Each measurement runs in a fresh process.
+
+The notebook is generated by nbgen.py, whose shape options are accepted,
+with defaults for many small cells without figures.
+
+Usage:
+  python benchmarks/bench_cells.py [--compare REV] [--cells N] [options]
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, here)
+
+import nbgen
+
+formats = ['rst', 'quick-html']
+# Shape of the notebook, see nbgen.make_notebook
+default_shape = dict(nbgen.default_shape, cells=20000, output_lines=1,
+                     images_per_cell=0.0, error_ratio=0.0)
+
+
+def measure(shape, repeat=5):
+    """Print the best time per cell for each format, in microseconds, as
+    JSON.  Like timeit, this turns off garbage collection while timing."""
+    import nbconvert
+    nb = nbgen.make_notebook(**shape)
+    ncells = shape['cells']
+    tmpdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        infile = os.path.join(tmpdir, 'bench.ipynb')
+        for format in formats:
+            best = None
+            for i in range(repeat):
+                converter = nbconvert.converters[format](infile)
+                converter.nb = nb
+                gc.disable()
+                start = time.time()
+                converter.convert()
+                elapsed = time.time() - start
+                gc.enable()
+                best = elapsed if best is None else min(best, elapsed)
+            results[format] = best / ncells * 1e6
+    finally:
+        shutil.rmtree(tmpdir)
+    print(json.dumps(results))
+
+
+def run(tree, shape):
+    """Measure the nbconvert found in the directory tree."""
+    env = dict(os.environ, PYTHONPATH=tree)
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                   '--measure', json.dumps(shape)],
+                                  env=env, cwd=tree)
+    return json.loads(out)
+
+
+def export(rev):
+    """Extract the files of git revision rev to a temporary directory."""
+    tmpdir = tempfile.mkdtemp()
+    archive = subprocess.Popen(['git', 'archive', rev], cwd=root,
+                               stdout=subprocess.PIPE)
+    subprocess.check_call(['tar', '-x', '-C', tmpdir], stdin=archive.stdout)
+    if archive.wait():
+        raise SystemExit('Could not export revision %s' % rev)
+    return tmpdir
+
+
+def main(args):
+    if args.measure:
+        measure(json.loads(args.measure))
+        return
+    trees = [('working tree', root)]
+    if args.compare:
+        trees.insert(0, (args.compare, export(args.compare)))
+    shape = nbgen.shape_from_args(args)
+
+    print('%i cells, microseconds per cell' % shape['cells'])
+    print('%-14s' % '' + ''.join('%12s' % f for f in formats))
+    try:
+        for name, tree in trees:
+            results = run(tree, shape)
+            print('%-14s' % name +
+                  ''.join('%12.1f' % results[f] for f in formats))
+    finally:
+        for name, tree in trees:
+            if tree != root:
+                shutil.rmtree(tree)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--compare', metavar='REV',
+                        help='Also measure this git revision')
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    nbgen.add_shape_arguments(parser)
+    parser.set_defaults(**default_shape)
+    main(parser.parse_args())
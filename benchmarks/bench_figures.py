@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Benchmark writing base64 image outputs to disk.
+
+Compares decoding the whole payload in memory before writing it, as
+Converter._new_figure used to, with the block-by-block decoding it does now.
+For each image size, prints the throughput and the peak memory used on top of
+the encoded payload itself.  Each measurement runs in a fresh process, since
+peak memory can only go up.
+
+Usage:
+  python benchmarks/bench_figures.py [size_in_MB ...]
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def maxrss():
+    """Peak resident memory of this process, in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return rss / (2.0**20 if sys.platform == 'darwin' else 2.0**10)
+
+
+def measure(mode, payload):
+    """Write the image in the payload file with the given mode.
+
+    Prints the throughput in MB of image per second, and the peak memory
+    used beyond the encoded payload."""
+    from nbconvert import iter_base64_decode
+    with open(payload) as f:
+        data = f.read()
+    size = len(data) * 3 / 4.0 / 2**20
+    fd, fname = tempfile.mkstemp()
+    os.close(fd)
+    base = maxrss()
+    start = time.time()
+    with open(fname, 'wb') as f:
+        if mode == 'whole':
+            f.write(data.decode('base64'))
+        else:
+            for block in iter_base64_decode(data):
+                f.write(block)
+    elapsed = time.time() - start
+    os.unlink(fname)
+    print(size / elapsed, maxrss() - base)
+
+
+def main(sizes):
+    print('%8s %8s %10s %12s' % ('size MB', 'mode', 'MB/s', 'peak MB'))
+    fd, payload = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        for size in sizes:
+            with open(payload, 'wb') as f:
+                # Pieces of 3*256k bytes, whose encodings have no padding
+                for i in range(size * 4 // 3):
+                    f.write(base64.encodestring(os.urandom(3 * 2**18)))
+            for mode in ('whole', 'blocks'):
+                out = subprocess.check_output([sys.executable, __file__,
+                                               '--measure', mode, payload])
+                speed, peak = map(float, out.split())
+                print('%8i %8s %10.1f %12.1f' % (size, mode, speed, peak))
+    finally:
+        os.unlink(payload)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('sizes', metavar='size_in_MB', type=int, nargs='*',
+                        default=[1, 8, 32, 128],
+                        help='Image sizes (default: %(default)s)')
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(*args.measure)
+    else:
+        main(args.sizes)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""Benchmark the startup time of nbconvert.
+
+Measures, each in a fresh interpreter, the time to:
+
+- import: import the nbconvert module
+- help: run `nbconvert.py --help`
+- convert: convert a notebook with a single cell to rst
+
+and prints the best of several runs, in milliseconds.  The startup of the
+interpreter itself is measured too, and subtracted.  With --compare REV, the
+same measurements are also made with the nbconvert of that git revision.
+
+Usage:
+  python benchmarks/bench_import.py [--compare REV] [--repeat N]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, here)
+
+from bench_cells import export
+
+tiny_notebook = """{
+ "metadata": {"name": "tiny"},
+ "nbformat": 3,
+ "nbformat_minor": 0,
+ "worksheets": [{"cells": [{
+  "cell_type": "code", "collapsed": false, "input": ["1 + 1"],
+  "language": "python", "metadata": {}, "prompt_number": 1,
+  "outputs": [{"metadata": {}, "output_type": "pyout", "prompt_number": 1,
+               "text": ["2"]}]}], "metadata": {}}]
+}
+"""
+
+tasks = ['import', 'help', 'convert']
+
+
+def commands(tree):
+    """Return the command line timed for each task, in tree."""
+    script = os.path.join(tree, 'nbconvert.py')
+    return {'python': [sys.executable, '-c', 'pass'],
+            'import': [sys.executable, '-c', 'import nbconvert'],
+            'help': [sys.executable, script, '--help'],
+            'convert': [sys.executable, script, '-f', 'rst', 'tiny.ipynb']}
+
+
+def best_time(cmd, cwd, env, repeat):
+    """Return the best wall time of running cmd, in seconds."""
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeat):
+            start = time.time()
+            subprocess.check_call(cmd, cwd=cwd, env=env, stdout=devnull)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(tree, repeat):
+    """Return the startup time of each task for the nbconvert in tree, in
+    milliseconds."""
+    workdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(workdir, 'tiny.ipynb'), 'w') as f:
+            f.write(tiny_notebook)
+        env = dict(os.environ, PYTHONPATH=tree)
+        cmds = commands(tree)
+        python = best_time(cmds['python'], workdir, env, repeat)
+        return dict((task, (best_time(cmds[task], workdir, env, repeat) -
+                            python) * 1e3)
+                    for task in tasks)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(args):
+    repeat = args.repeat
+    trees = [('working tree', root)]
+    if args.compare:
+        trees.insert(0, (args.compare, export(args.compare)))
+
+    print('milliseconds, best of %i, without the interpreter startup' %
+          repeat)
+    print('%-14s' % '' + ''.join('%10s' % t for t in tasks))
+    try:
+        for name, tree in trees:
+            results = measure(tree, repeat)
+            print('%-14s' % name + ''.join('%10.1f' % results[t]
+                                           for t in tasks))
+    finally:
+        for name, tree in trees:
+            if tree != root:
+                shutil.rmtree(tree)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--compare', metavar='REV',
+                        help='Also measure this git revision')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Runs of each measurement (default: '
+                        '%(default)s)')
+    main(parser.parse_args())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""Benchmark rst2ipynb on a large generated reStructuredText document.
+
+The document is made of sections holding paragraphs with inline markup,
+bullet lists, notes and doctest-style literal blocks, repeated to the
+requested size.  It is converted in a fresh process for each mode:
+
+- memory: the notebook is built in memory, and serialized at the end
+- stream: the cells are written to the output file as they are made
+
+and the conversion time, the time spent translating the doctree, and the
+peak memory of the process are reported.  With --compare REV, the memory
+mode (the only one older revisions have) is also measured with the
+rst2ipynb of that git revision.
+
+Usage:
+  python benchmarks/bench_rst2ipynb.py [--compare REV] [sections]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, here)
+
+from bench_cells import export
+
+section = """
+Section %(i)i
+=============
+
+Some *emphasis*, **strong text**, ``literal code`` and a reference_ in a
+paragraph which goes on for a few lines, as paragraphs do, with a `link
+<http://example.com/%(i)i>`_ and some more words to make it long enough.
+
+- A bullet item with *markup*
+- Another item, with ``code``
+
+.. note::
+
+   A note, whose paragraph becomes a cell too.
+
+.. _reference: http://example.com
+
+Subsection %(i)i
+----------------
+
+An example::
+
+    >>> x = %(i)i
+    >>> x + 1
+    %(j)i
+
+A last paragraph for section %(i)i.
+"""
+
+
+def make_document(nsections):
+    """Return a reStructuredText document with nsections sections."""
+    return ''.join(section % dict(i=i, j=i + 1) for i in xrange(nsections))
+
+
+def measure(mode, infile, outfile):
+    """Convert infile to outfile, printing the timings as JSON."""
+    import docutils.core
+    import rst2ipynblib
+
+    translate = [0.0]
+    Writer = rst2ipynblib.Writer
+
+    class TimedWriter(Writer):
+        def translate(self):
+            start = time.time()
+            Writer.translate(self)
+            translate[0] += time.time() - start
+
+    # Don't print the warnings
+    settings = dict(report_level=5)
+    start = time.time()
+    writer = TimedWriter()
+    if mode == 'stream':
+        import rst2ipynb
+        converter = rst2ipynb.BatchConverter(settings)
+        converter.writer = writer
+        converter.convert(infile, outfile)
+    else:
+        with open(infile, 'rb') as f:
+            source = f.read()
+        output = docutils.core.publish_string(
+            source, source_path=infile, writer=writer,
+            settings_overrides=settings)
+        with open(outfile, 'wb') as f:
+            f.write(output)
+    elapsed = time.time() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps(dict(time=elapsed, translate=translate[0],
+                          maxrss=maxrss)))
+
+
+def run(tree, mode, infile, outfile):
+    env = dict(os.environ, PYTHONPATH=tree)
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                   '--measure', mode, infile, outfile],
+                                  env=env, cwd=tree)
+    return json.loads(out)
+
+
+def main(args):
+    if args.measure:
+        measure(*args.measure)
+        return
+    runs = [('memory', root), ('stream', root)]
+    trees = []
+    if args.compare:
+        tree = export(args.compare)
+        trees.append(tree)
+        runs.insert(0, ('%s memory' % args.compare, tree))
+    nsections = args.sections
+
+    workdir = tempfile.mkdtemp()
+    try:
+        infile = os.path.join(workdir, 'large.rst')
+        with open(infile, 'w') as f:
+            f.write(make_document(nsections))
+        print('%i sections, %.1f MB of rst' % (
+            nsections, os.path.getsize(infile) / 2.0**20))
+        print('%-20s%10s%12s%12s' % ('', 'seconds', 'translate',
+                                     'max RSS MB'))
+        for name, tree in runs:
+            mode = name.split()[-1]
+            outfile = os.path.join(workdir, name.replace(' ', '-') + '.ipynb')
+            r = run(tree, mode, infile, outfile)
+            print('%-20s%10.2f%12.2f%12.1f' % (name, r['time'], r['translate'],
+                                               r['maxrss'] / 1024.0))
+        outputs = set()
+        for name, tree in runs:
+            with open(os.path.join(workdir, name.replace(' ', '-') +
+                                   '.ipynb'), 'rb') as f:
+                outputs.add(f.read())
+        if len(outputs) > 1:
+            print('The notebooks differ!')
+    finally:
+        shutil.rmtree(workdir)
+        for tree in trees:
+            shutil.rmtree(tree)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('sections', type=int, nargs='?', default=5000,
+                        help='Sections in the document (default: '
+                        '%(default)s)')
+    parser.add_argument('--compare', metavar='REV',
+                        help='Also measure this git revision')
+    parser.add_argument('--measure', nargs=3, help=argparse.SUPPRESS)
+    main(parser.parse_args())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""Time the converters, phase by phase, on a synthetic notebook.
+
+A notebook of the requested shape is generated (see nbgen.py) and converted
+to rst, quick-html and latex.  pandoc and inkscape are replaced by stub
+executables which do no work, so that only nbconvert's own time is measured.
+For each converter the best of several runs is reported, for each phase:
+
+- read: parsing the notebook file
+- convert: rendering the cells, not counting figures
+- figures: writing the figure files, and converting SVG figures to PDF
+- save: writing the output file
+
+The results are printed as JSON, along with the notebook shape and the
+nbconvert revision, so that runs can be compared across releases.
+
+Usage:
+  python benchmarks/bench_suite.py [options]
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, root)
+
+from IPython.nbformat import current as nbformat
+
+import nbgen
+
+formats = ['rst', 'quick-html', 'latex']
+phases = ['read', 'convert', 'figures', 'save']
+# Methods whose time counts as figure handling rather than conversion
+figure_methods = ['_new_figure', '_svg_lines', 'wait_for_svg2pdf']
+
+stubs = {
+    'pandoc': """
+import sys
+if '--version' in sys.argv:
+    print('pandoc stub')
+else:
+    sys.stdout.write(sys.stdin.read())
+""",
+    'inkscape': """
+import sys
+if '--version' in sys.argv:
+    print('Inkscape stub')
+else:
+    pdf = sys.argv[1].split('=', 1)[1]
+    with open(pdf, 'wb') as f:
+        f.write('%PDF-1.4 stub\\n')
+""",
+}
+
+
+def install_stubs(bindir):
+    """Write the stub executables to bindir, and put it first on the PATH."""
+    for name, code in stubs.items():
+        fname = os.path.join(bindir, name)
+        with open(fname, 'w') as f:
+            f.write('#!%s\n%s' % (sys.executable, code))
+        os.chmod(fname, 0o755)
+    os.environ['PATH'] = bindir + os.pathsep + os.environ.get('PATH', '')
+
+
+def revision():
+    """Return the git revision of the nbconvert being measured, if known."""
+    try:
+        p = subprocess.Popen(['git', 'describe', '--always', '--dirty'],
+                             cwd=root, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    return p.communicate()[0].strip() or None
+
+
+def _timed(timings, method):
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timings['figures'] += time.time() - start
+    return wrapper
+
+
+def time_conversion(format, infile):
+    """Convert infile once, returning the time spent in each phase."""
+    import nbconvert
+    converter = nbconvert.converters[format](infile)
+    timings = dict.fromkeys(phases, 0.0)
+    for name in figure_methods:
+        method = getattr(converter, name, None)
+        if method is not None:
+            setattr(converter, name, _timed(timings, method))
+
+    start = time.time()
+    converter.read()
+    timings['read'] = time.time() - start
+    start = time.time()
+    converter.output = converter.convert()
+    timings['convert'] = time.time() - start - timings['figures']
+    start = time.time()
+    converter.save()
+    timings['save'] = time.time() - start
+    return timings
+
+
+def run(shape, seed=0, repeat=3, formats=formats):
+    """Run the benchmark, returning the results as a dict."""
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.mkdir(os.path.join(workdir, 'bin'))
+        install_stubs(os.path.join(workdir, 'bin'))
+        infile = os.path.join(workdir, 'synthetic.ipynb')
+        with open(infile, 'w') as f:
+            nbformat.write(nbgen.make_notebook(seed, **shape), f, 'json')
+        # Converters save to the current directory
+        os.chdir(workdir)
+        results = {}
+        for format in formats:
+            runs = [time_conversion(format, infile) for i in range(repeat)]
+            best = dict((phase, min(r[phase] for r in runs))
+                        for phase in phases)
+            best['total'] = min(sum(r.values()) for r in runs)
+            results[format] = best
+        return dict(nbconvert=revision(), python=platform.python_version(),
+                    shape=shape, seed=seed, repeat=repeat,
+                    notebook_bytes=os.path.getsize(infile), results=results)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+def print_table(report, stream=sys.stdout):
+    print('%-12s' % 'seconds' + ''.join('%10s' % p for p in phases) +
+          '%10s' % 'total', file=stream)
+    for format in formats:
+        if format in report['results']:
+            r = report['results'][format]
+            print('%-12s' % format + ''.join('%10.4f' % r[p] for p in phases) +
+                  '%10.4f' % r['total'], file=stream)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-o', '--output',
+                        help='Write the JSON results to this file, and print '
+                        'a table instead.')
+    parser.add_argument('-f', '--formats', default=','.join(formats),
+                        help='Comma-separated formats (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    nbgen.add_shape_arguments(parser)
+    args = parser.parse_args()
+
+    report = run(nbgen.shape_from_args(args), args.seed, args.repeat,
+                 args.formats.split(','))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        print_table(report)
+    else:
+        print(json.dumps(report, indent=1, sort_keys=True))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+"""Generate synthetic notebooks of a given shape for the benchmarks.
+
+The notebooks are v3 notebooks, like those IPython writes, made of heading,
+markdown and code cells.  Code cells print some lines of output and show
+their result, and may display images or end in an error.  The content is
+pseudo-random but reproducible: the same shape and seed always give the same
+notebook.
+
+Usage:
+  python benchmarks/nbgen.py [options] out.ipynb
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import random
+
+from IPython.nbformat import current as nbformat
+
+# Shape of the notebooks made by default, see make_notebook
+default_shape = dict(cells=200, markdown_ratio=0.3, output_lines=10,
+                     images_per_cell=0.2, image_kb=20, svg_ratio=0.0,
+                     error_ratio=0.05, traceback_lines=20)
+
+_words = ('the data model fit error mean value array plot signal sample '
+          'matrix vector function result test noise filter').split()
+
+
+def _sentence(rng, nwords=12):
+    words = [rng.choice(_words) for i in range(nwords)]
+    words[0] = words[0].capitalize()
+    return ' '.join(words) + '.'
+
+
+def _markdown(rng):
+    """Return some markdown with the usual inline markup, lists and math."""
+    lines = [_sentence(rng), 'Some *emphasis*, **strong** and `code`, '
+             'with $x^2 + y_%i$ math.' % rng.randint(0, 9), '']
+    lines.extend('- %s' % _sentence(rng, 5) for i in range(3))
+    lines.extend(['', _sentence(rng)])
+    return u'\n'.join(lines)
+
+
+def _image(rng, fmt, image_kb):
+    """Return an image output field of about image_kb kilobytes."""
+    size = image_kb * 1024
+    if fmt == 'svg':
+        shapes = ['<circle cx="%i" cy="%i" r="%i"/>' %
+                  (rng.randint(0, 400), rng.randint(0, 300),
+                   rng.randint(1, 50))
+                  for i in range(max(1, size // 40))]
+        return u'<svg xmlns="http://www.w3.org/2000/svg">%s</svg>' % (
+            u''.join(shapes))
+    data = ('%0*x' % (2 * size, rng.getrandbits(8 * size))).decode('hex')
+    return base64.encodestring('\x89PNG\r\n\x1a\n' + data).decode('ascii')
+
+
+def _traceback(rng, nlines):
+    """Return a traceback with the ANSI colors IPython puts in them."""
+    frames = [u'\x1b[0;31m%s\x1b[0m' % ('-' * 75),
+              u'\x1b[0;31mValueError\x1b[0m  Traceback (most recent call last)']
+    for i in range(nlines):
+        frames.append(u'\x1b[0;32m<ipython-input-%i>\x1b[0m in '
+                      u'\x1b[0;36mf%i\x1b[0;34m(x)\x1b[0m\n      %s' %
+                      (i, i, _sentence(rng, 6)))
+    frames.append(u'\x1b[0;31mValueError\x1b[0m: bad value')
+    return frames
+
+
+def _code_cell(rng, n, shape):
+    source = u'\n'.join('x%i = f(%i)' % (i, rng.randint(0, 99))
+                        for i in range(3)) + u'\nprint x0\nx1'
+    outputs = []
+    if shape['output_lines']:
+        text = u''.join('%s\n' % _sentence(rng, 8)
+                        for i in range(shape['output_lines']))
+        stream = nbformat.new_output(u'stream', text)
+        stream.stream = u'stdout'
+        outputs.append(stream)
+    # A fractional number of images per cell is a probability for the last
+    images = int(shape['images_per_cell'])
+    if rng.random() < shape['images_per_cell'] - images:
+        images += 1
+    for i in range(images):
+        fmt = 'svg' if rng.random() < shape['svg_ratio'] else 'png'
+        output = nbformat.new_output(u'display_data')
+        output[fmt] = _image(rng, fmt, shape['image_kb'])
+        outputs.append(output)
+    if rng.random() < shape['error_ratio']:
+        outputs.append(nbformat.new_output(
+            u'pyerr', etype=u'ValueError', evalue=u'bad value',
+            traceback=_traceback(rng, shape['traceback_lines'])))
+    else:
+        outputs.append(nbformat.new_output(u'pyout', u'%r' % rng.random(),
+                                           prompt_number=n))
+    return nbformat.new_code_cell(source, prompt_number=n, outputs=outputs)
+
+
+def make_notebook(seed=0, **shape):
+    """Return a synthetic notebook.
+
+    Parameters
+    ----------
+    cells : int
+      Number of cells, one in ten being a heading.
+    markdown_ratio : float
+      Fraction of the other cells which are markdown rather than code.
+    output_lines : int
+      Lines printed by each code cell.
+    images_per_cell : float
+      Average number of images displayed by each code cell.
+    image_kb : int
+      Size of each image, in kilobytes.
+    svg_ratio : float
+      Fraction of the images which are SVG rather than PNG.
+    error_ratio : float
+      Fraction of code cells ending in an error instead of a result.
+    traceback_lines : int
+      Number of frames in the tracebacks of errors.
+
+    Anything not given is taken from default_shape.
+    """
+    unknown = set(shape) - set(default_shape)
+    if unknown:
+        raise TypeError('Unknown notebook shape %s' % ', '.join(unknown))
+    shape = dict(default_shape, **shape)
+    rng = random.Random(seed)
+    cells = []
+    for n in xrange(shape['cells']):
+        if n % 10 == 0:
+            cells.append(nbformat.new_heading_cell(
+                u'Section %i' % (n // 10), rng.randint(1, 3)))
+        elif rng.random() < shape['markdown_ratio']:
+            cells.append(nbformat.new_text_cell(u'markdown', _markdown(rng)))
+        else:
+            cells.append(_code_cell(rng, n, shape))
+    return nbformat.new_notebook(
+        name=u'synthetic', worksheets=[nbformat.new_worksheet(cells=cells)])
+
+
+def add_shape_arguments(parser):
+    """Add an option for each field of the notebook shape to parser."""
+    for name, default in sorted(default_shape.items()):
+        parser.add_argument('--' + name.replace('_', '-'), dest=name,
+                            type=type(default), default=default,
+                            help='(default: %(default)s)')
+
+
+def shape_from_args(args):
+    """Return the notebook shape given on the command line."""
+    return dict((name, getattr(args, name)) for name in default_shape)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('outfile')
+    parser.add_argument('--seed', type=int, default=0)
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+    nb = make_notebook(args.seed, **shape_from_args(args))
+    with open(args.outfile, 'w') as f:
+        nbformat.write(nb, f, 'json')
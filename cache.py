@@ -0,0 +1,244 @@
+"""
+Content-addressed cache with an in-memory LRU tier in front of a disk tier.
+
+Usage:
+
+cache = ContentCache('/tmp/nbconvert-cache')
+key = content_key('pandoc 1.9', 'markdown->latex', src)
+out = cache.get(key)
+if out is None:
+    out = expensive(src)
+    cache.set(key, out)
+
+Values are byte strings.  The disk tier is safe to share between several
+processes: entries are written to a temporary file and renamed into place,
+so readers only ever see complete entries, and a reader that loses a race
+against eviction simply gets a miss.
+"""
+
+import errno
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+# mkstemp creates files only their owner can read, atomic_write gives them
+# the permissions of a regular open() instead.
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def content_key(*parts):
+    """Return a hex digest identifying the given sequence of strings.
+
+    Unicode parts are encoded as utf-8, and the parts are length-prefixed
+    so that ('ab', 'c') and ('a', 'bc') give different keys.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        h.update('%d:' % len(part))
+        h.update(part)
+    return h.hexdigest()
+
+
+class ContentCache(object):
+    """Two-tier cache of byte strings keyed by `content_key` digests.
+
+    Parameters
+    ----------
+    path : string or None
+      Directory holding the disk tier.  It is created if needed.  With None,
+      only the memory tier is used.
+
+    max_items : int
+      Number of entries kept in the in-memory LRU tier.
+
+    max_bytes : int
+      Size cap for the disk tier.  When exceeded, the least recently used
+      entries are removed until the cache is back under 90% of the cap.
+    """
+
+    def __init__(self, path=None, max_items=1024, max_bytes=256 * 2**20):
+        self.path = path
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # Bytes written since the disk tier size was last checked
+        self._written = 0
+        if path is not None and not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    def stats(self):
+        """Return a dict with the hit and miss counters."""
+        return dict(hits=self.hits, memory_hits=self.memory_hits,
+                    disk_hits=self.disk_hits, misses=self.misses)
+
+    def _filename(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key, default=None):
+        """Return the value stored for key, or default if there is none."""
+        with self._lock:
+            if key in self._memory:
+                value = self._memory.pop(key)
+                self._memory[key] = value
+                self.memory_hits += 1
+                return value
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return default
+            self.disk_hits += 1
+            self._memory_set(key, value)
+        return value
+
+    def set(self, key, value):
+        """Store value (a byte string) under key in both tiers."""
+        with self._lock:
+            self._memory_set(key, value)
+        self._disk_set(key, value)
+
+    def __contains__(self, key):
+        if key in self._memory:
+            return True
+        return self.path is not None and os.path.exists(self._filename(key))
+
+    def clear(self):
+        """Remove every entry, from memory and from disk."""
+        with self._lock:
+            self._memory.clear()
+        for fname, size, mtime in self._disk_entries():
+            _unlink(fname)
+
+    def _memory_set(self, key, value):
+        self._memory.pop(key, None)
+        self._memory[key] = value
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key):
+        if self.path is None:
+            return None
+        fname = self._filename(key)
+        try:
+            with open(fname, 'rb') as f:
+                value = f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        # Recently used entries are the last to be evicted
+        try:
+            os.utime(fname, None)
+        except OSError:
+            pass
+        return value
+
+    def _disk_set(self, key, value):
+        if self.path is None:
+            return
+        fname = self._filename(key)
+        dirname = os.path.dirname(fname)
+        if not os.path.isdir(dirname):
+            try:
+                os.mkdir(dirname)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        atomic_write(fname, value)
+
+        with self._lock:
+            self._written += len(value)
+            check = self._written > self.max_bytes // 10
+            if check:
+                self._written = 0
+        if check:
+            self.evict()
+
+    def _disk_entries(self):
+        """Return a list of (filename, size, mtime) for the disk tier."""
+        entries = []
+        if self.path is None:
+            return entries
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for fname in filenames:
+                if fname.startswith('.tmp'):
+                    continue
+                fname = os.path.join(dirpath, fname)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                entries.append((fname, st.st_size, st.st_mtime))
+        return entries
+
+    def evict(self):
+        """Trim the disk tier to the size cap, least recently used first."""
+        entries = self._disk_entries()
+        total = sum(size for fname, size, mtime in entries)
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 9 // 10
+        for fname, size, mtime in sorted(entries, key=lambda e: e[2]):
+            if total <= target:
+                break
+            _unlink(fname)
+            total -= size
+
+
+def atomic_write(fname, data):
+    """Write data to fname so that readers never see a partially written file.
+
+    data is either a byte string, or a function which is called with the open
+    file and writes the contents to it, and whose result is returned.  It
+    goes to a temporary file in the same directory, which is then renamed
+    over fname.
+    """
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(fname) or '.',
+                                   prefix='.tmp')
+    result = None
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if callable(data):
+                result = data(f)
+            else:
+                f.write(data)
+        os.chmod(tmpname, 0o666 & ~_umask)
+        os.rename(tmpname, fname)
+    except OSError:
+        _unlink(tmpname)
+        # On Windows rename fails if another process wrote the same file
+        # first, in which case there is nothing left to do.
+        if not (sys.platform == 'win32' and os.path.isfile(fname)):
+            raise
+    except:
+        _unlink(tmpname)
+        raise
+    return result
+
+
+def _unlink(fname):
+    """Remove fname, ignoring the case where it is already gone."""
+    try:
+        os.unlink(fname)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
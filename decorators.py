@@ -15,6 +15,11 @@ class Bar(Foo):
 
 Now, Bar.foo.__doc__ == Bar().foo.__doc__ == Foo.foo.__doc__ == "Frobber"
 See: http://stackoverflow.com/questions/2025562/inherit-docstrings-in-python-class-inheritance
+
+On its own, the decorator makes a new wrapper function every time the method
+is looked up.  In classes using the DocInheritMeta metaclass (or derived from
+one that does), the docstrings are instead copied once, when the class is
+created, and the methods are left as plain functions.
 """
 
 from functools import wraps
@@ -49,9 +54,7 @@ class DocInherit(object):
 
     def get_no_inst(self, cls):
 
-        for parent in cls.__mro__[1:]:
-            overridden = getattr(parent, self.name, None)
-            if overridden: break
+        overridden = self.find_overridden(cls)
 
         @wraps(self.mthd, assigned=('__name__', '__module__'))
         def f(*args, **kwargs):
@@ -65,4 +68,28 @@ class DocInherit(object):
         func.__doc__ = source.__doc__
         return func
 
+    def find_overridden(self, cls):
+        for parent in cls.__mro__[1:]:
+            overridden = getattr(parent, self.name, None)
+            if overridden: break
+        return overridden
+
+    def resolve(self, cls):
+        """Return the decorated method, with the docstring it has in cls.
+        """
+        return self.use_parent_doc(self.mthd, self.find_overridden(cls))
+
+
+class DocInheritMeta(type):
+    """
+    Metaclass resolving the DocInherit methods of a class once, when it is
+    created
+    """
+
+    def __init__(cls, name, bases, dct):
+        super(DocInheritMeta, cls).__init__(name, bases, dct)
+        for attr, value in dct.items():
+            if isinstance(value, DocInherit):
+                setattr(cls, attr, value.resolve(cls))
+
 doc_inherit = DocInherit
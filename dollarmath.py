@@ -8,29 +8,134 @@ The $math$ markup should be separated from the surrounding text by spaces.
 To embed markup within a word, place backslash-space before and after.
 For convenience, the final $ can be followed by punctuation
 (period, comma or semicolon).
+
+The rewritten sources are cached in the doctree directory, keyed by their
+content, so that incremental builds don't scan the unchanged documents
+again.  Set dollarmath_cache = False in conf.py to turn this off.  The
+handlers keep no other state, so the extension is safe for parallel builds.
 """
 
+import imp
+import os
 import re
+import sys
+
+
+def _load_cache():
+    """Return the cache module which comes with this extension.
+
+    It is loaded from its file, under a name of its own: as a Sphinx
+    extension, `import cache` would get whatever module called cache comes
+    first on Sphinx's sys.path."""
+    name = 'dollarmath_cache'
+    if name not in sys.modules:
+        here = os.path.dirname(os.path.realpath(__file__))
+        imp.load_source(name, os.path.join(here, 'cache.py'))
+    return sys.modules[name]
 
+_cache = _load_cache()
+ContentCache, content_key = _cache.ContentCache, _cache.content_key
+
+# Changing the rewriting rules must change this, to invalidate the cache
+rewrite_version = '2'
+
+# Cache of the rewritten sources, None when off (see enable_cache)
+source_cache = None
+
+# The markup as regular expressions, which replace_dollar implements with a
+# scanner: _dollar.sub(r":math:`\1`", ...) then _notdollar.sub("$", ...)
 dollar_pat = r"(?:^|(?<=\s))[$]([^\n]*?)(?<![\\])[$](?:$|(?=\s|[.,;\\]))"
 _dollar = re.compile(dollar_pat)
 _notdollar = re.compile(r"\\[$]")
 
+# What \s matches, without re.UNICODE
+_space = ' \t\n\r\f\v'
+# What may follow the closing $
+_after = _space + '.,;\\'
+
 def replace_dollar(content):
-    content = _dollar.sub(r":math:`\1`", content)
-    content = _notdollar.sub("$", content)
-    return content
+    if '$' not in content:
+        return content
+    pieces = []
+    done = 0
+    n = len(content)
+    i = content.find('$')
+    while i >= 0:
+        # The opening $ starts the text or follows a space
+        if i == 0 or content[i-1] in _space:
+            eol = content.find('\n', i)
+            if eol < 0:
+                eol = n
+            # The closing $ is the first one on the same line which isn't
+            # escaped, and ends the text or is followed by _after
+            j = content.find('$', i+1, eol)
+            while j >= 0:
+                if content[j-1] != '\\' and (j+1 == n or
+                                             content[j+1] in _after):
+                    pieces.append(content[done:i])
+                    pieces.append(':math:`%s`' % content[i+1:j])
+                    done = j+1
+                    i = j
+                    break
+                j = content.find('$', j+1, eol)
+        i = content.find('$', i+1)
+    pieces.append(content[done:])
+    return ''.join(pieces).replace('\\$', '$')
+
+def replace_dollar_lines(lines):
+    """Apply replace_dollar to each of lines, in place.
+
+    Lines without any $ are left alone without being scanned."""
+    for i, line in enumerate(lines):
+        if '$' in line:
+            lines[i] = replace_dollar(line)
+
+def enable_cache(path, **kwargs):
+    """Cache the rewritten sources in memory and in the directory path.
+
+    Extra keyword arguments are passed to ContentCache.  Returns the cache.
+    """
+    global source_cache
+    source_cache = ContentCache(path, **kwargs)
+    return source_cache
+
+def rewrite_source(source):
+    """replace_dollar for a whole document, going through source_cache."""
+    if source_cache is None or '$' not in source:
+        return replace_dollar(source)
+    key = content_key(rewrite_version, source)
+    cached = source_cache.get(key)
+    if cached is not None:
+        if isinstance(source, unicode):
+            cached = cached.decode('utf-8')
+        return cached
+    result = replace_dollar(source)
+    if isinstance(result, unicode):
+        source_cache.set(key, result.encode('utf-8'))
+    else:
+        source_cache.set(key, result)
+    return result
+
+def init_cache(app):
+    if app.config.dollarmath_cache:
+        enable_cache(os.path.join(app.doctreedir, 'dollarmath'),
+                     max_items=128)
 
 def rewrite_rst(app, docname, source):
-    source[0] = replace_dollar(source[0])
+    source[0] = rewrite_source(source[0])
 
 def rewrite_autodoc(app, what, name, obj, options, lines):
-    lines[:] = [replace_dollar(L) for L in lines]
+    replace_dollar_lines(lines)
 
 def setup(app):
+    app.add_config_value('dollarmath_cache', True, '')
+    app.connect('builder-inited', init_cache)
     app.connect('source-read', rewrite_rst)
     if 'autodoc-process-docstring' in app._events:
         app.connect('autodoc-process-docstring', rewrite_autodoc)
+    return {'version': rewrite_version,
+            'parallel_read_safe': True,
+            'parallel_write_safe': True}
 
 def test_expr(expr, expect):
     result = replace_dollar(expr)
@@ -41,21 +146,23 @@ def test_expr(expr, expect):
     else:
         print 'NG: A result %s does not match expected one!' % result
 
+# Expressions and their expected rewriting
+samples = {
+    u"no dollar": u"no dollar",
+    u"$only$": u":math:`only`",
+    u"$first$ is good": u":math:`first` is good",
+    u"so is $last$": u"so is :math:`last`",
+    u"and $mid$ too": u"and :math:`mid` too",
+    u"$first$, $mid$, $last$": u":math:`first`, :math:`mid`, :math:`last`",
+    u"dollar\$ escape": u"dollar$ escape",
+    u"dollar \$escape\$ too": u"dollar $escape$ too",
+    u"emb\ $ed$\ ed": u"emb\ :math:`ed`\ ed",
+    u"$first$a": u"$first$a",
+    u"a$last$": u"a$last$",
+    u"a $mid$dle a": u"a $mid$dle a",
+}
+
 def test_dollar():
-    samples = {
-        u"no dollar": u"no dollar",
-        u"$only$": u":math:`only`",
-        u"$first$ is good": u":math:`first` is good",
-        u"so is $last$": u"so is :math:`last`",
-        u"and $mid$ too": u"and :math:`mid` too",
-        u"$first$, $mid$, $last$": u":math:`first`, :math:`mid`, :math:`last`",
-        u"dollar\$ escape": u"dollar$ escape",
-        u"dollar \$escape\$ too": u"dollar $escape$ too",
-        u"emb\ $ed$\ ed": u"emb\ :math:`ed`\ ed",
-        u"$first$a": u"$first$a",
-        u"a$last$": u"a$last$",
-        u"a $mid$dle a": u"a $mid$dle a",
-    }
     for expr, expect in samples.items():
         test_expr(expr, expect)
 
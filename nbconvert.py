@@ -8,37 +8,62 @@ Produces 'file.rst' and 'file.html', along with auto-generated figure files
 called nb_figure_NN.png. To avoid the two-step process, ipynb -> rst -> html,
 use '--format quick-html' which will do ipynb -> html, but won't look as
 pretty.
+
+Several notebooks, glob patterns or directories can be given at once, in which
+case they are converted in batch mode, optionally in parallel:
+  ./nbconvert.py --format latex --jobs 8 notebooks/
+
+Adding --incremental skips the notebooks which haven't changed since they were
+last converted that way.
 """
 #-----------------------------------------------------------------------------
 # Imports
 #-----------------------------------------------------------------------------
 from __future__ import print_function
 
+# Heavier modules, and anything from IPython (whose package imports most of
+# IPython), are imported where they are needed, to keep the startup fast.
+
 # Stdlib
-import codecs
+import binascii
+import collections
+import copy
+import errno
+import glob
+import hashlib
+import itertools
+import json
 import logging
 import os
 import pprint
 import re
-import subprocess
+import string
 import sys
+import threading
+import time
+import traceback
 
-inkscape = 'inkscape'
-if sys.platform == 'darwin':
-    inkscape = '/Applications/Inkscape.app/Contents/Resources/bin/inkscape'
-    if not os.path.exists(inkscape):
-        inkscape = None
+from StringIO import StringIO
 
-# From IPython
-from IPython.external import argparse
-from IPython.nbformat import current as nbformat
-from IPython.utils.text import indent
-from decorators import DocInherit
+# Our own
+import batch
+from batch import makedirs
+from cache import ContentCache, atomic_write, content_key
+from decorators import DocInherit, DocInheritMeta
+import stats
+import tools
 
 #-----------------------------------------------------------------------------
 # Utility functions
 #-----------------------------------------------------------------------------
 
+def indent(instr, nspaces=4):
+    """Indent a string, see IPython.utils.text.indent."""
+    # Imported here to keep IPython out of the startup time
+    from IPython.utils.text import indent
+    return indent(instr, nspaces)
+
+
 def remove_fake_files_url(cell):
     """Remove from the cell source the /files/ pseudo-path we use.
     """
@@ -61,12 +86,52 @@ def remove_ansi(src):
 
 
 # Pandoc-dependent code
+pandoc_cmd = 'pandoc -f markdown -t latex'.split()
+# Cache for markdown2latex results, off by default (see enable_markdown_cache)
+markdown_cache = None
+_pandoc_version = None
+
+
+def pandoc_version():
+    """Return the first line of `pandoc --version`, which names the version.
+    """
+    global _pandoc_version
+    if _pandoc_version is None:
+        out, err = tools.run('pandoc', [pandoc_cmd[0], '--version'])
+        _pandoc_version = out.splitlines()[0]
+    return _pandoc_version
+
+
+def enable_markdown_cache(path, **kwargs):
+    """Cache markdown2latex results in memory and in the directory path.
+
+    Entries are keyed by the markdown source, the pandoc version and the
+    pandoc arguments.  Extra keyword arguments are passed to ContentCache.
+    Returns the cache, whose hit and miss counters can be inspected.
+    """
+    global markdown_cache
+    markdown_cache = ContentCache(path, **kwargs)
+    return markdown_cache
+
+
+def _markdown_key(src):
+    return content_key(pandoc_version(), ' '.join(pandoc_cmd), src)
+
+
+def _pandoc(src):
+    """Run src through pandoc, returning the raw utf-8 output."""
+    out, err = tools.run('pandoc', pandoc_cmd, src.encode('utf-8'))
+    #print('*'*20+'\n', out, '\n'+'*'*20)  # dbg
+    return out
+
+
+@stats.timed('markdown2latex')
 def markdown2latex(src):
     """Convert a markdown string to LaTeX via pandoc.
 
     This function will raise an error if pandoc is not installed.
 
-    Any error messages generated by pandoc are printed to stderr.
+    Any error messages generated by pandoc are logged, see `tools`.
 
     Parameters
     ----------
@@ -78,13 +143,307 @@ def markdown2latex(src):
     out : string
       Output as returned by pandoc.
     """
-    p = subprocess.Popen('pandoc -f markdown -t latex'.split(),
-                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    out, err = p.communicate(src.encode('utf-8'))
-    if err:
-        print(err, file=sys.stderr)
-    #print('*'*20+'\n', out, '\n'+'*'*20)  # dbg
-    return unicode(out,'utf-8')
+    if markdown_cache is None:
+        return unicode(_pandoc(src), 'utf-8')
+    key = _markdown_key(src)
+    out = markdown_cache.get(key)
+    if out is None:
+        out = _pandoc(src)
+        markdown_cache.set(key, out)
+    return unicode(out, 'utf-8')
+
+
+# Markdown constructs whose meaning depends on the rest of the pandoc document
+# (section labels, implicit header links, reference links, title blocks,
+# example lists numbered across the document, LaTeX macro definitions and
+# footnotes).  Cells containing them are never batched with other cells, so
+# that markdown2latex_many gives exactly what markdown2latex gives on each
+# cell.
+_pandoc_global_re = re.compile(
+    r'^(\s{0,3}#|%|\s{0,3}\[[^\]]*\]:|\s{0,3}(=+|-+)\s*$)|'
+    r'\(@[\w-]*\)|'
+    r'\\(re)?newcommand|\\providecommand|\\(re)?newenvironment|'
+    r'\\[gex]?def\b|\\let\b|'
+    r'\^\[|\[\^', re.MULTILINE)
+
+
+@stats.timed('markdown2latex_many')
+def markdown2latex_many(sources, max_batch_size=2**18):
+    """Convert a list of markdown strings to LaTeX with few pandoc calls.
+
+    The sources are joined into as few pandoc documents as possible, with a
+    unique separator paragraph between them, and the output is split back
+    along the separators.  The result is identical to calling
+    `markdown2latex` on each source: sources which could be affected by their
+    neighbours are converted on their own, and if the separators don't come
+    back out as expected the batch is redone one source at a time.
+
+    Parameters
+    ----------
+    sources : list of strings
+      Input strings, assumed to be valid markdown.
+
+    max_batch_size : int
+      Approximate upper bound on the number of characters sent to a single
+      pandoc call.
+
+    Returns
+    -------
+    out : list of strings
+      The pandoc output for each of the input strings.
+    """
+    import uuid
+    converted = {}
+    batches, batch, size = [], [], 0
+    for src in sources:
+        if src in converted:
+            continue
+        converted[src] = None
+        if markdown_cache is not None:
+            out = markdown_cache.get(_markdown_key(src))
+            if out is not None:
+                converted[src] = unicode(out, 'utf-8')
+                continue
+        if not src.strip() or _pandoc_global_re.search(src):
+            batches.append([src])
+            continue
+        if batch and size + len(src) > max_batch_size:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(src)
+        size += len(src)
+    if batch:
+        batches.append(batch)
+
+    for batch in batches:
+        if len(batch) == 1:
+            converted[batch[0]] = markdown2latex(batch[0])
+            continue
+        separator = u'nbconvertcellbreak%s' % uuid.uuid4().hex
+        out = unicode(_pandoc((u'\n\n%s\n\n' % separator).join(batch)),
+                      'utf-8')
+        parts = out.split(u'\n\n%s\n\n' % separator)
+        if (len(parts) != len(batch) or
+            out.count(separator) != len(batch) - 1):
+            # The markdown swallowed a separator (e.g. an unclosed code
+            # fence or html block), fall back to one pandoc call per cell.
+            parts = [markdown2latex(src) for src in batch]
+        else:
+            parts = [part + u'\n' for part in parts[:-1]] + parts[-1:]
+            if markdown_cache is not None:
+                for src, part in zip(batch, parts):
+                    markdown_cache.set(_markdown_key(src),
+                                       part.encode('utf-8'))
+        converted.update(zip(batch, parts))
+
+    return [converted[src] for src in sources]
+
+
+# Inkscape-dependent code
+# The inkscape executable, found on first use (see find_inkscape)
+inkscape = None
+# Cache for svg2pdf results, off by default (see enable_svg_cache)
+svg_cache = None
+_inkscape_version = None
+# Key of the version of inkscape which made the PDFs in svg_cache
+_svg_version_key = content_key('svg2pdf', 'inkscape version')
+
+
+def find_inkscape():
+    """Return the inkscape executable, looking for it the first time."""
+    global inkscape
+    if inkscape is None:
+        inkscape = 'inkscape'
+        if sys.platform == 'darwin':
+            app = '/Applications/Inkscape.app/Contents/Resources/bin/inkscape'
+            if os.path.exists(app):
+                inkscape = app
+    return inkscape
+
+
+def inkscape_version():
+    """Return the output of `inkscape --version`."""
+    global _inkscape_version
+    if _inkscape_version is None:
+        out, err = tools.run('inkscape', [find_inkscape(), '--version'],
+                             check=False)
+        _inkscape_version = out.strip()
+    return _inkscape_version
+
+
+def enable_svg_cache(path, max_items=32, **kwargs):
+    """Cache the PDF files made by svg2pdf in the directory path.
+
+    Entries are keyed by the content of the SVG file and the inkscape
+    version.  Only a few PDFs are kept in memory, see ContentCache for the
+    other keyword arguments.  Returns the cache.
+    """
+    global svg_cache
+    svg_cache = ContentCache(path, max_items=max_items, **kwargs)
+    return svg_cache
+
+
+def svg_version():
+    """Return the version of inkscape the PDFs of SVG figures are made with.
+
+    When inkscape isn't installed, that is the version which made the PDFs
+    in svg_cache, so that they can still be used, or None."""
+    try:
+        return inkscape_version()
+    except OSError:
+        if svg_cache is None:
+            return None
+        return svg_cache.get(_svg_version_key)
+
+
+@stats.timed('svg2pdf')
+def svg2pdf(svg_file, pdf_file):
+    """Convert an SVG file to PDF with inkscape.
+
+    This function will raise an error if inkscape is not installed, unless
+    the PDF for an identical SVG file is found in svg_cache.
+    """
+    if svg_cache is not None:
+        version = svg_version()
+        if version is not None:
+            with open(svg_file, 'rb') as f:
+                pdf = svg_cache.get(content_key(version, f.read()))
+            if pdf is not None:
+                atomic_write(pdf_file, pdf)
+                return
+    tools.run('inkscape', [find_inkscape(), '--export-pdf=%s' % pdf_file,
+                           svg_file])
+    if svg_cache is not None:
+        # inkscape ran, so its version is known
+        version = inkscape_version()
+        with open(svg_file, 'rb') as f:
+            key = content_key(version, f.read())
+        with open(pdf_file, 'rb') as f:
+            svg_cache.set(key, f.read())
+        svg_cache.set(_svg_version_key, version)
+
+
+def svg2pdf_data(svg):
+    """Return the PDF inkscape makes from the SVG document svg (a byte
+    string).
+
+    inkscape only works on files, so the SVG and PDF go through a temporary
+    directory, unless the PDF is found in svg_cache."""
+    version = svg_version() if svg_cache is not None else None
+    if version is not None:
+        pdf = svg_cache.get(content_key(version, svg))
+        if pdf is not None:
+            return pdf
+    import shutil
+    import tempfile
+    tmpdir = tempfile.mkdtemp(prefix='nbconvert-')
+    try:
+        svg_file = os.path.join(tmpdir, 'figure.svg')
+        pdf_file = os.path.join(tmpdir, 'figure.pdf')
+        with open(svg_file, 'wb') as f:
+            f.write(svg)
+        svg2pdf(svg_file, pdf_file)
+        with open(pdf_file, 'rb') as f:
+            return f.read()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# Characters skipped by the base64 decoder, which must not count towards the
+# 4-character groups decoded at a time by iter_base64_decode
+_base64_skipped = ''.join(c for c in map(chr, range(256)) if c not in
+                          string.ascii_letters + string.digits + '+/=')
+
+
+def _base64_quads(chars, final):
+    """Split base64 characters, without the skipped ones, into the part which
+    can be decoded now and the part to carry over to the next block.
+
+    Pad characters are dealt with as binascii.a2b_base64 does: a '=' ends
+    the data when it is the fourth character of a group, or the third one
+    followed by another '=', and is skipped otherwise.  Whether a third
+    character '=' is followed by another one may only be known with the
+    next block, unless this is the final one.
+
+    Returns (decodable, carry, done), done being true once the data ended.
+    """
+    i = chars.find('=')
+    while i != -1:
+        pos = i % 4
+        if pos == 3 or (pos == 2 and chars[i + 1:i + 2] == '='):
+            # Anything after the padding is ignored
+            return chars[:i] + '=' * (4 - pos), '', True
+        if pos == 2 and i + 1 == len(chars) and not final:
+            end = i - 2
+            return chars[:end], chars[end:], False
+        # A stray pad character
+        chars = chars[:i] + chars[i + 1:]
+        i = chars.find('=', i)
+    end = len(chars) - len(chars) % 4
+    return chars[:end], chars[end:], False
+
+
+def iter_base64_decode(data, block_size=2**18):
+    """Decode a base64 string one block at a time.
+
+    This avoids holding a decoded copy of a large image in memory at once.
+
+    Parameters
+    ----------
+    data : string
+      Base64 encoded data, possibly split across lines.
+
+    block_size : int
+      Number of characters of data decoded at a time.
+
+    Returns
+    -------
+    An iterator over the decoded byte strings, whose concatenation is
+    data.decode('base64').  Data which data.decode('base64') rejects raises
+    the same binascii.Error, once the blocks before the error have been
+    yielded.
+    """
+    carry = ''
+    for start in xrange(0, len(data), block_size):
+        chunk = str(data[start:start + block_size])
+        chunk = carry + chunk.translate(None, _base64_skipped)
+        final = start + block_size >= len(data)
+        chunk, carry, done = _base64_quads(chunk, final)
+        if chunk:
+            yield binascii.a2b_base64(chunk)
+        if done:
+            return
+    if carry:
+        # Let the decoder complain about the incomplete data
+        yield binascii.a2b_base64(carry)
+
+
+def output_file(infile, extension):
+    """Return the name of the file the conversion of infile is saved as.
+
+    It is named after the notebook, but written to the current directory,
+    see `output_collisions`."""
+    root = os.path.splitext(os.path.basename(infile))[0]
+    return root + '.' + extension
+
+
+def _output_tasks(infiles, format):
+    extension = converters[format].extension
+    return [(infile, output_file(infile, extension)) for infile in infiles]
+
+
+def output_collisions(infiles, format):
+    """Return the notebooks of infiles whose conversions to format would be
+    saved to the same file, as a dict mapping each such file to the list of
+    its notebooks."""
+    return batch.output_collisions(_output_tasks(infiles, format))
+
+
+def check_outputs(infiles, format):
+    """Refuse to convert notebooks which would overwrite each other's
+    output, such as x/index.ipynb and y/index.ipynb.  Raises
+    batch.OutputCollision, see batch.check_outputs."""
+    batch.check_outputs(_output_tasks(infiles, format))
 
 
 def rst_directive(directive, text=''):
@@ -93,6 +452,24 @@ def rst_directive(directive, text=''):
         out.extend([indent(text), ''])
     return out
 
+
+# Cache for the lines of rendered cells, off by default (see
+# enable_fragment_cache)
+fragment_cache = None
+
+
+def enable_fragment_cache(path, **kwargs):
+    """Cache the rendered lines of each cell in memory and in the directory
+    path.
+
+    When a notebook is converted again, only the cells which changed are
+    rendered, see Converter.convert_cell.  Extra keyword arguments are passed
+    to ContentCache.  Returns the cache.
+    """
+    global fragment_cache
+    fragment_cache = ContentCache(path, **kwargs)
+    return fragment_cache
+
 #-----------------------------------------------------------------------------
 # Class declarations
 #-----------------------------------------------------------------------------
@@ -101,10 +478,17 @@ class ConversionException(Exception):
     pass
 
 
+def _convert_cell_in_worker(args):
+    """Convert a cell with a copy of the converter, for iter_cell_blocks."""
+    worker, cell = args
+    return worker.convert_cell(cell)
+
+
 class Converter(object):
+    # Resolves the @DocInherit methods of the converters once and for all
+    __metaclass__ = DocInheritMeta
     default_encoding = 'utf-8'
     extension = str()
-    figures_counter = 0
     infile = str()
     infile_dir = str()
     infile_root = str()
@@ -113,85 +497,407 @@ class Converter(object):
     user_preamble = None
     output = str()
     raw_as_verbatim = False
+    # Have render() write the output one cell at a time, instead of building
+    # it in memory as a single string first
+    stream_output = False
+    # Have read() decode the notebook's cells one at a time, as they are
+    # converted, instead of loading the whole notebook up front
+    stream_input = False
+    # The notebook file streamed cells are read from, see close_input
+    input_file = None
+    # How figure files are named: 'counter' gives <root>_fig_NN.<fmt>, while
+    # 'hash' names them after a hash of their content, so that identical
+    # figures share a single file which is only written once.
+    figure_naming = 'counter'
+    # Optional directory shared by many notebooks, where figures are stored
+    # once by content hash and hard-linked into each notebook's files_dir.
+    figure_store = None
+    # Figure files written by this converter, see _new_figure, and the sha1
+    # digests of their contents (only for those written by _new_figure)
+    figures = None
+    figure_digests = None
+    # Keep the figures in figure_data, mapping their names to their contents,
+    # instead of writing them (see convert_notebook)
+    in_memory = False
+    figure_data = None
+    # Settings which change how cells are rendered, and so are part of the
+    # fragment_cache keys
+    fragment_settings = ('raw_as_verbatim', 'figure_naming')
+    # Fragment cache lookups done ahead of the conversion, as (key, fragment)
+    # by id of the cell, see _convert_cell
+    prefetched_fragments = None
+    # Render method for each cell and output type, see dispatch
+    dispatch_table = None
+    # Number of cells rendered at the same time by a thread pool, see
+    # iter_cell_blocks.  The output is the same as with 1, the default.
+    cell_workers = 1
+    # Formats of the figures render_display_data makes, in order
+    figure_formats = ('png', 'svg', 'jpg', 'pdf')
         
     def __init__(self, infile):
         self.infile = infile
+        # Number of the next figure, see _new_figure
+        self.figures_counter = 0
+        # Each figure of the notebook once, and those the cell being
+        # converted refers to, see _add_figure
+        self.figures = []
+        self.cell_figures = []
+        self._figure_names = set()
+        self.figure_digests = {}
+        self.figure_data = {}
+        self.dispatch_table = dict((name[len('render_'):], getattr(self, name))
+                                   for name in dir(self)
+                                   if name.startswith('render_'))
         self.infile_dir = os.path.dirname(infile)
-        infile_root = os.path.splitext(infile)[0]
-        files_dir = infile_root + '_files'
-        if not os.path.isdir(files_dir):
-            os.mkdir(files_dir)
-        self.infile_root = infile_root
-        self.files_dir = files_dir
+        self.infile_root = os.path.splitext(infile)[0]
+        # Only created once a figure is written to it
+        self.files_dir = self.infile_root + '_files'
 
     def dispatch(self, cell_type):
         """return cell_type dependent render method,  for example render_code
         """
-        return getattr(self, 'render_' + cell_type, self.render_unknown)
+        try:
+            return self.dispatch_table[cell_type]
+        except KeyError:
+            return self.render_unknown
+
+    def iter_blocks(self):
+        """Yield the converted document as a sequence of lists of lines.
+
+        There is one list for the header, one for each cell and one for the
+        footer, so the document can be written out as it is produced."""
+        yield self.optional_header()
+        cells = (cell for worksheet in self.nb.worksheets
+                 for cell in worksheet.cells)
+        if self.cell_workers > 1:
+            blocks = self.iter_cell_blocks(cells)
+        else:
+            blocks = (self.convert_cell(cell) for cell in cells)
+        try:
+            for block in blocks:
+                block.append(u'')
+                yield block
+        finally:
+            # Streamed cells can only be gone through once
+            self.close_input()
+        yield self.optional_footer()
+
+    def count_figures(self, cell):
+        """Return the number of figures rendering cell will make.
+
+        Converters whose render methods make figures other than those of
+        render_display_data must override this, for iter_cell_blocks."""
+        if cell.cell_type != 'code' or not cell.input:
+            return 0
+        return sum(fmt in output for output in cell.outputs
+                   if output.output_type == 'display_data'
+                   for fmt in self.figure_formats)
+
+    def iter_cell_blocks(self, cells):
+        """Convert cells with a pool of cell_workers threads.
+
+        Yields the lines of each cell, in order.  The figure numbers of each
+        cell are known up front (see count_figures), so every cell is
+        rendered by its own copy of the converter, starting from the right
+        number, and the output is the same as that of a serial conversion.
+        Only a few cells per thread are taken ahead of the one being
+        yielded, so that streamed cells aren't all read in at once."""
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.cell_workers)
+        pending = collections.deque()
+        try:
+            for cell in cells:
+                worker = self._cell_worker()
+                self.figures_counter += self.count_figures(cell)
+                job = pool.apply_async(_convert_cell_in_worker,
+                                       [(worker, cell)])
+                pending.append((worker, self.figures_counter, job))
+                if len(pending) == 4 * self.cell_workers:
+                    yield self._finish_cell(*pending.popleft())
+            while pending:
+                yield self._finish_cell(*pending.popleft())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _finish_cell(self, worker, end, job):
+        """Return the lines of a cell rendered by iter_cell_blocks, once they
+        are ready, and record its figures."""
+        lines = job.get()
+        if worker.figures_counter != end:
+            raise ConversionException('A cell made figures up to %i instead '
+                                      'of %i, see count_figures' %
+                                      (worker.figures_counter, end))
+        self._merge_figures(worker.figures)
+        self.figure_digests.update(worker.figure_digests)
+        return lines
+
+    def _cell_worker(self):
+        """Return a copy of the converter to render a single cell with,
+        starting from the current figure number."""
+        worker = copy.copy(self)
+        worker.figures = []
+        worker.cell_figures = []
+        worker._figure_names = set()
+        worker.figure_digests = {}
+        worker.dispatch_table = dict(
+            (name, method.__func__.__get__(worker, type(worker)))
+            for name, method in self.dispatch_table.items())
+        return worker
+
+    def _add_figure(self, name):
+        """Record that the cell being converted refers to the figure file
+        name.  self.figures lists every figure of the notebook once, in the
+        order they first appear."""
+        self.cell_figures.append(name)
+        self._merge_figures([name])
+
+    def _merge_figures(self, names):
+        for name in names:
+            if name not in self._figure_names:
+                self._figure_names.add(name)
+                self.figures.append(name)
+
+    def convert_cell(self, cell):
+        """Return the list of lines for cell, from the fragment cache if
+        possible."""
+        with stats.timer('cell.' + cell.cell_type):
+            return self._convert_cell(cell)
+
+    def _convert_cell(self, cell):
+        self.cell_figures = []
+        if fragment_cache is not None:
+            lookup = None
+            if self.prefetched_fragments:
+                lookup = self.prefetched_fragments.pop(id(cell), None)
+            if lookup is None:
+                key = self.fragment_key(cell)
+                lookup = key, self.get_fragment(key)
+            key, fragment = lookup
+            if fragment is not None:
+                self.figures_counter += fragment['count']
+                for name, digest in fragment['figures']:
+                    self._add_figure(name)
+                    if digest:
+                        self.figure_digests[name] = digest
+                return fragment['lines']
+            counter = self.figures_counter
+
+        conv_fn = self.dispatch(cell.cell_type)
+        if cell.cell_type in ('markdown', 'raw'):
+            remove_fake_files_url(cell)
+        lines = list(conv_fn(cell))
+
+        if fragment_cache is not None:
+            fragment = dict(lines=lines, counter=counter,
+                            count=self.figures_counter - counter,
+                            figures=[(name, self.figure_digests.get(name))
+                                     for name in self.cell_figures])
+            fragment_cache.set(key, json.dumps(fragment))
+        return lines
+
+    def fragment_key(self, cell):
+        """Return the key of the rendered cell in the fragment cache.
+
+        It covers the cell, the converter and its settings, and the name of
+        the notebook, which figure names are derived from."""
+        settings = [(name, getattr(self, name))
+                    for name in self.fragment_settings]
+        return content_key('fragment', type(self).__name__,
+                           nbconvert_version(), repr(settings),
+                           self.infile_root,
+                           json.dumps(cell, sort_keys=True))
+
+    def get_fragment(self, key):
+        """Return the cached fragment for key, if it can be reused.
+
+        That is if the figures it refers to still exist with the same
+        content and, when they are numbered, with the same numbers."""
+        data = fragment_cache.get(key)
+        if data is None:
+            return None
+        fragment = json.loads(data)
+        if self.in_memory and fragment['figures']:
+            # The figures are only on disk, if anywhere
+            return None
+        if (fragment['count'] and self.figure_naming != 'hash' and
+            fragment['counter'] != self.figures_counter):
+            return None
+        for name, digest in fragment['figures']:
+            # Figures without a digest are derived from another one, such as
+            # the PDF made from an SVG figure
+            if not os.path.exists(name):
+                return None
+            if digest and file_hash(name) != digest:
+                return None
+        return fragment
 
     def convert(self):
         lines = []
-        lines.extend(self.optional_header())
-        for worksheet in self.nb.worksheets:
-            for cell in worksheet.cells:
-                #print(cell.cell_type)  # dbg
-                conv_fn = self.dispatch(cell.cell_type)
-                if cell.cell_type in ('markdown', 'raw'):
-                    remove_fake_files_url(cell)
-                lines.extend(conv_fn(cell))
-                lines.append(u'')
-        lines.extend(self.optional_footer())
+        for block in self.iter_blocks():
+            lines.extend(block)
         return u'\n'.join(lines)
 
     def render(self):
         "read, convert, and save self.infile"
         self.read()
-        self.output = self.convert()
-        return self.save()
-
+        try:
+            if self.stream_output:
+                return self.save_stream()
+            self.output = self.convert()
+            return self.save()
+        finally:
+            self.close_input()
+
+    @stats.timed('read')
     def read(self):
         "read and parse notebook into NotebookNode called self.nb"
+        if self.stream_input:
+            import nbstream
+            # Cells are decoded as convert() gets to them, so the file has to
+            # stay open until then; iter_blocks closes it once they are done.
+            self.input_file = open(self.infile, 'rb')
+            self.nb = nbstream.read(self.input_file)
+            return
+        from IPython.nbformat import current as nbformat
         with open(self.infile) as f:
             self.nb = nbformat.read(f, 'json')
 
+    def close_input(self):
+        """Close the notebook file, if streamed cells are read from it."""
+        if self.input_file is not None:
+            self.input_file.close()
+            self.input_file = None
+
     def save(self, infile=None, encoding=None):
         "read and parse notebook into self.nb"
         if infile is None:
-            outfile = os.path.basename(self.infile)
-            outfile = os.path.splitext(outfile)[0] + '.' + self.extension
+            outfile = output_file(self.infile, self.extension)
+        if encoding is None:
+            encoding = self.default_encoding
+        with stats.timer('save') as t:
+            data = self.output.encode(encoding)
+            with open(outfile, 'w') as f:
+                f.write(data)
+            t.bytes += len(data)
+        return os.path.abspath(outfile)
+
+    def save_stream(self, encoding=None):
+        """Convert self.nb and write it out one cell at a time.
+
+        Produces the same file as convert() followed by save(), but only one
+        cell's output is held in memory at any time."""
+        outfile = output_file(self.infile, self.extension)
         if encoding is None:
             encoding = self.default_encoding
-        with open(outfile, 'w') as f:
-            f.write(self.output.encode(encoding))
+        # This includes the conversion, which happens as blocks are written
+        with stats.timer('save') as t:
+            with open(outfile, 'w') as f:
+                self.write_blocks(f, encoding)
+                t.bytes += f.tell()
         return os.path.abspath(outfile)
 
+    def write_blocks(self, f, encoding=None):
+        """Write the blocks from iter_blocks to the file object f.
+
+        The lines are separated by newlines and encoded as they come, exactly
+        as they would be in the output of convert()."""
+        if encoding is None:
+            encoding = self.default_encoding
+        sep = ''
+        for block in self.iter_blocks():
+            if block:
+                f.write(sep)
+                f.write(u'\n'.join(block).encode(encoding))
+                sep = '\n'
+
     def optional_header(self):
         return []
 
     def optional_footer(self):
         return []
 
+    @stats.timed('figure')
     def _new_figure(self, data, fmt):
         """Create a new figure file in the given format.
 
         Returns a path relative to the input file.
         """
-        figname = '%s_fig_%02i.%s' % (self.infile_root, 
-                                      self.figures_counter, fmt)
+        root = os.path.basename(self.infile_root)
+        if self.figure_naming == 'hash' or self.figure_store:
+            digest = hashlib.sha1()
+            for block in self._figure_blocks(data, fmt):
+                digest.update(block)
+            digest = digest.hexdigest()
+        if self.figure_naming == 'hash':
+            figname = '%s_fig_%s.%s' % (root, digest, fmt)
+        else:
+            figname = '%s_fig_%02i.%s' % (root, self.figures_counter, fmt)
         self.figures_counter += 1
         fullname = os.path.join(self.files_dir, figname)
+        self._add_figure(fullname)
+
+        if self.in_memory:
+            f = StringIO()
+            digest = self._write_figure(f, data, fmt)
+            self.figure_data[fullname] = f.getvalue()
+        elif self.figure_naming == 'hash' and os.path.exists(fullname):
+            # Same name, same content: this figure has been written already
+            # (and completely, see below)
+            pass
+        elif self.figure_store:
+            makedirs(self.files_dir)
+            self._link_figure(data, fmt, '%s.%s' % (digest, fmt), fullname)
+        else:
+            makedirs(self.files_dir)
+            # Written to a temporary file renamed into place, so that an
+            # interrupted write can't leave a truncated figure behind
+            digest = atomic_write(
+                fullname, lambda f: self._write_figure(f, data, fmt))
+        self.figure_digests[fullname] = digest
+
+        return fullname
 
+    def _figure_blocks(self, data, fmt):
+        """Iterate over the contents of a figure file, one block at a time.
+        """
         # Binary files are base64-encoded, SVG is already XML
         if fmt in ('png', 'jpg', 'pdf'):
-            data = data.decode('base64')
-            fopen = lambda fname: open(fname, 'wb')
-        else:
-            fopen = lambda fname: codecs.open(fname, 'wb', self.default_encoding)
-            
-        with fopen(fullname) as f:
-            f.write(data)
-            
-        return fullname
+            return iter_base64_decode(data)
+        return [data.encode(self.default_encoding)]
+
+    def _write_figure(self, f, data, fmt):
+        """Write the contents of a figure to the open file f.
+
+        Returns the sha1 hex digest of the contents."""
+        digest = hashlib.sha1()
+        size = 0
+        for block in self._figure_blocks(data, fmt):
+            digest.update(block)
+            f.write(block)
+            size += len(block)
+        stats.add('figure', bytes=size)
+        return digest.hexdigest()
+
+    def _link_figure(self, data, fmt, store_name, fullname):
+        """Hard-link a figure from the shared figure store to fullname.
+
+        The figure is added to the store first if needed.  When hard links
+        aren't possible (e.g. the store is on another device), the figure is
+        written to fullname instead.
+        """
+        makedirs(self.figure_store)
+        stored = os.path.join(self.figure_store, store_name)
+        if not os.path.exists(stored):
+            atomic_write(stored, lambda f: self._write_figure(f, data, fmt))
+        if os.path.exists(fullname):
+            if os.path.samefile(stored, fullname):
+                return
+            os.unlink(fullname)
+        try:
+            os.link(stored, fullname)
+        except (OSError, AttributeError):
+            atomic_write(fullname, lambda f: self._write_figure(f, data, fmt))
 
     def render_heading(self, cell):
         """convert a heading cell
@@ -237,7 +943,7 @@ class Converter(object):
         """
         lines = []
 
-        for fmt in ['png', 'svg', 'jpg', 'pdf']:
+        for fmt in self.figure_formats:
             if fmt in output:
                 img_file = self._new_figure(output[fmt], fmt)
                 # Subclasses can have format-specific render functions (e.g.,
@@ -283,6 +989,7 @@ class Converter(object):
 class ConverterRST(Converter):
     extension = 'rst'
     heading_level = {1: '=', 2: '-', 3: '`', 4: '\'', 5: '.', 6: '~'}
+    fragment_settings = Converter.fragment_settings + ('heading_level',)
 
     @DocInherit
     def render_heading(self, cell):
@@ -471,6 +1178,20 @@ class ConverterLaTeX(Converter):
                    4: r'\paragraph',
                    5: r'\subparagraph',
                    6: r'\subparagraph'}
+    # Convert all markdown cells with a few pandoc calls up front, rather than
+    # running pandoc once per cell (see markdown2latex_many)
+    batch_markdown = True
+    # Pandoc output for markdown sources, filled by the batch conversion
+    markdown_latex = None
+    # Number of SVG figures converted to PDF at the same time
+    svg_workers = 4
+    # Thread pool running the SVG conversions, and the conversion of each
+    # PDF file: its pending result, or None when it ran in the calling thread.
+    # Shared with the cell workers, under _svg_lock.
+    svg_pool = None
+    svg_jobs = None
+    _svg_lock = threading.Lock()
+    fragment_settings = Converter.fragment_settings + ('heading_map',)
 
     def in_env(self, environment, lines):
         """Return list of environment lines for input lines
@@ -489,12 +1210,47 @@ class ConverterLaTeX(Converter):
         out.append(ur'\end{%s}' % environment)
         return out
 
-    def convert(self):
+    def convert_markdown_cells(self):
+        """Run all markdown cells through pandoc at once.
+
+        The results are stored in self.markdown_latex, keyed by the markdown
+        source as it will be seen by render_markdown.  Cells found in the
+        fragment cache are left out, and the lookups kept for _convert_cell
+        in self.prefetched_fragments."""
+        cells = [cell for worksheet in self.nb.worksheets
+                 for cell in worksheet.cells if cell.cell_type == 'markdown']
+        if fragment_cache is not None:
+            self.prefetched_fragments = {}
+            for cell in cells:
+                key = self.fragment_key(cell)
+                self.prefetched_fragments[id(cell)] = (key,
+                                                       self.get_fragment(key))
+            cells = [cell for cell in cells
+                     if self.prefetched_fragments[id(cell)][1] is None]
+        sources = [cell.source.replace('/files/', '') for cell in cells]
+        self.markdown_latex = dict(zip(sources,
+                                       markdown2latex_many(sources)))
+
+    def _iter_body(self):
+        """Iterate over the body blocks, making sure that all the figures
+        they refer to have been created by the time it is exhausted."""
+        try:
+            for block in super(ConverterLaTeX, self).iter_blocks():
+                yield block
+        finally:
+            self.wait_for_svg2pdf()
+
+    def iter_blocks(self):
+        # Streamed cells can only be gone through once, by the conversion
+        if self.batch_markdown and not self.stream_input:
+            self.convert_markdown_cells()
         # The main body is done by the logic in the parent class, and that's
         # all we need if preamble support has been turned off.
-        body = super(ConverterLaTeX, self).convert()
+        body = self._iter_body()
         if not self.with_preamble:
-            return body
+            for block in body:
+                yield block
+            return
         # But if preamble is on, then we need to construct a proper, standalone
         # tex file.
         
@@ -522,12 +1278,28 @@ class ConverterLaTeX(Converter):
                 final.append(f.read())
                 
         # Include document body
-        final.extend([ r'\begin{document}', '',
-                       body,
-                       r'\end{document}', ''])
-        # Retun value must be a string
-        return '\n'.join(final)
+        final.extend([ r'\begin{document}', ''])
+        yield final
+        empty = True
+        for block in body:
+            empty = empty and not block
+            yield block
+        if empty:
+            # An empty body still gets its own (blank) line
+            yield ['']
+        yield [ r'\end{document}', '']
         
+    def fragment_key(self, cell):
+        key = super(ConverterLaTeX, self).fragment_key(cell)
+        if cell.cell_type == 'markdown':
+            # Rendered by pandoc
+            key = content_key(key, pandoc_version())
+        elif any('svg' in output for output in cell.get('outputs', [])
+                 if output.output_type == 'display_data'):
+            # The PDFs made from its SVG figures depend on inkscape
+            key = content_key(key, svg_version() or '')
+        return key
+
     @DocInherit
     def render_heading(self, cell):
         marker = self.heading_map[cell.level]
@@ -566,10 +1338,63 @@ class ConverterLaTeX(Converter):
     def _svg_lines(self, img_file):
         base_file = os.path.splitext(img_file)[0]
         pdf_file = base_file + '.pdf'
-        subprocess.check_call([ inkscape, '--export-pdf=%s' % pdf_file,
-                               img_file])
+        self._add_figure(pdf_file)
+        if self.in_memory:
+            func, args = self._svg2pdf_in_memory, (img_file, pdf_file)
+        else:
+            func, args = svg2pdf, (img_file, pdf_file)
+        with self._svg_lock:
+            if self.svg_jobs is None:
+                self.svg_jobs = collections.OrderedDict()
+            if pdf_file in self.svg_jobs:
+                # Identical SVG figures named by hash share their PDF, which
+                # is only made once
+                return self._img_lines(pdf_file)
+            # The name of the PDF is all the output needs, so the conversion
+            # can run in the background while the rest of the notebook is
+            # converted
+            job = None
+            if self.svg_workers > 1:
+                if self.svg_pool is None:
+                    from multiprocessing.pool import ThreadPool
+                    self.svg_pool = ThreadPool(self.svg_workers)
+                job = self.svg_pool.apply_async(func, args)
+            self.svg_jobs[pdf_file] = job
+        if job is None:
+            func(*args)
         return self._img_lines(pdf_file)
 
+    def _cell_worker(self):
+        with self._svg_lock:
+            # Shared by the workers, so that each PDF is made once
+            if self.svg_jobs is None:
+                self.svg_jobs = collections.OrderedDict()
+        worker = super(ConverterLaTeX, self)._cell_worker()
+        # The cell's thread converts its SVG figures itself
+        worker.svg_workers = 1
+        return worker
+
+    def _svg2pdf_in_memory(self, svg_name, pdf_name):
+        self.figure_data[pdf_name] = svg2pdf_data(self.figure_data[svg_name])
+
+    def wait_for_svg2pdf(self):
+        """Wait for the background SVG to PDF conversions to be done.
+
+        This is done at the end of the conversion, but needs to be called
+        explicitly after using _svg_lines directly.  Raises the error of the
+        first conversion that failed, if any."""
+        jobs, self.svg_jobs = self.svg_jobs, None
+        pool, self.svg_pool = self.svg_pool, None
+        if pool is None:
+            return
+        try:
+            for job in jobs.values():
+                if job is not None:
+                    job.get()
+        finally:
+            pool.terminate()
+            pool.join()
+
     @DocInherit
     def render_stream(self, output):
         lines = []
@@ -581,6 +1406,8 @@ class ConverterLaTeX(Converter):
 
     @DocInherit
     def render_markdown(self, cell):
+        if self.markdown_latex and cell.source in self.markdown_latex:
+            return [self.markdown_latex[cell.source]]
         return [markdown2latex(cell.source)]
         
     @DocInherit
@@ -619,31 +1446,47 @@ class ConverterLaTeX(Converter):
 # Standalone conversion functions
 #-----------------------------------------------------------------------------
 
+# These are the options to rst2html that produce the cleanest, simplest html
+# I could find.  This should help in making it easier to paste into the
+# blogspot html window, though I'm still having problems with linebreaks
+# there...
+rst2html_options = ['--link-stylesheet', '--no-xml-declaration',
+                    '--no-generator', '--no-datestamp', '--no-source-link',
+                    '--no-toc-backlinks', '--no-section-numbering',
+                    '--strip-comments']
+# Docutils settings equivalent to rst2html_options, built on first use
+_rst2html_settings = None
+
+
+@stats.timed('rst2html')
 def rst2simplehtml(infile):
     """Convert a rst file to simplified html suitable for blogger.
 
     This just runs rst2html with certain parameters to produce really simple
     html and strips the document header, so the resulting file can be easily
     pasted into a blogger edit window.
+
+    The html is rendered in this process with the docutils publisher, which
+    avoids starting a new interpreter for every file, falling back to running
+    the rst2html script if docutils can't be imported.
     """
+    with open(infile, 'rb') as f:
+        source = f.read()
+    body = rst2html_body(source, infile)
+    newfname = os.path.splitext(infile)[0] + '.html'
+    with open(newfname, 'w') as f:
+        f.write(body)
+    stats.add('rst2html', bytes=len(body))
+    return newfname
 
-    # This is the template for the rst2html call that produces the cleanest,
-    # simplest html I could find.  This should help in making it easier to
-    # paste into the blogspot html window, though I'm still having problems
-    # with linebreaks there...
-    cmd_template = ("rst2html --link-stylesheet --no-xml-declaration "
-                    "--no-generator --no-datestamp --no-source-link "
-                    "--no-toc-backlinks --no-section-numbering "
-                    "--strip-comments ")
-
-    cmd = "%s %s" % (cmd_template, infile)
-    proc = subprocess.Popen(cmd,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=True)
-    html, stderr = proc.communicate()
-    if stderr:
-        raise IOError(stderr)
+
+def rst2html_body(source, source_path=None):
+    """Return the body of the simplified html for the rst source, see
+    `rst2simplehtml`."""
+    try:
+        html = _rst2html(source, source_path)
+    except ImportError:
+        html = _rst2html_cmd(source, source_path)
 
     # Make an iterator so breaking out holds state.  Our implementation of
     # searching for the html body below is basically a trivial little state
@@ -657,56 +1500,603 @@ def rst2simplehtml(infile):
         if line.startswith('<body>'):
             break
 
-    newfname = os.path.splitext(infile)[0] + '.html'
-    with open(newfname, 'w') as f:
-        for line in walker:
-            if line.startswith('</body>'):
-                break
-            f.write(line)
-            f.write('\n')
+    body = []
+    for line in walker:
+        if line.startswith('</body>'):
+            break
+        body.append(line + '\n')
+    return ''.join(body)
+
+
+def _rst2html(source, source_path=None):
+    """Return the html document rst2html would produce for source.
+
+    Like with rst2html, any warning from docutils is an error."""
+    global _rst2html_settings
+    from docutils.core import publish_string
+    from docutils.frontend import OptionParser
+    from docutils.parsers.rst import Parser
+    from docutils.readers.standalone import Reader
+    from docutils.utils import SystemMessage
+    from docutils.writers.html4css1 import Writer
+
+    if _rst2html_settings is None:
+        # Build the settings the same way rst2html does, config files included
+        parser = OptionParser(components=(Reader, Parser, Writer),
+                              read_config_files=True)
+        _rst2html_settings = parser.parse_args(rst2html_options)
+    settings = copy.copy(_rst2html_settings)
+    warnings = StringIO()
+    settings.warning_stream = warnings
+
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    try:
+        html = publish_string(source, source_path=source_path,
+                              writer_name='html', settings=settings)
+    except SystemMessage as e:
+        raise IOError(warnings.getvalue() or str(e))
+    if warnings.getvalue():
+        raise IOError(warnings.getvalue())
+    return html
+
+
+def _rst2html_cmd(source, source_path=None):
+    """Return the html document produced by running rst2html on source.
+
+    It runs from the directory of source_path, which relative paths in the
+    source, such as those of included files, are resolved against."""
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    cwd = None
+    if source_path is not None:
+        cwd = os.path.dirname(os.path.abspath(source_path))
+    html, stderr = tools.run('rst2html', ['rst2html'] + rst2html_options,
+                             source, check=False, cwd=cwd)
+    if stderr:
+        raise IOError(stderr)
+    return html
 
-    return newfname
 
 known_formats = "rst (default), html, quick-html, latex"
+# Converter class for each format, html is converted to rst first
+converters = {'rst': ConverterRST,
+              'html': ConverterRST,
+              'quick-html': ConverterQuickHTML,
+              'latex': ConverterLaTeX}
+
+def main(infile, format='rst', incremental=False, **options):
+    """Convert a notebook to html in one step
+
+    Any keyword arguments are set as attributes of the converter, for example
+    raw_as_verbatim=True or figure_naming='hash'.  With incremental=True, the
+    notebook is only converted if it changed since the last incremental
+    conversion (see `build`).
+
+    Returns the name of the output file."""
+    if incremental:
+        return build(infile, format, **options)[0]
+    converter, outfiles = _convert(infile, format, options)
+    return outfiles[-1]
+
 
-def main(infile, format='rst'):
-    """Convert a notebook to html in one step"""
+def _convert(infile, format, options):
+    """Do the conversion for `main`.
+
+    Returns the converter used and the list of files written, other than
+    figures, the final output being last."""
     # XXX: this is just quick and dirty for now. When adding a new format,
-    # make sure to add it to the `known_formats` string above, which gets
-    # printed in in the catch-all else, as well as in the help
-    if format == 'rst':
-        converter = ConverterRST(infile)
-        converter.render()
-    elif format == 'html':
-        #Currently, conversion to html is a 2 step process, nb->rst->html
-        converter = ConverterRST(infile)
-        rstfname = converter.render()
-        rst2simplehtml(rstfname)
-    elif format == 'quick-html':
-        converter = ConverterQuickHTML(infile)
-        rstfname = converter.render()
-    elif format == 'latex':
-        converter = ConverterLaTeX(infile)
-        latexfname = converter.render()
+    # make sure to add it to `converters` and to the `known_formats` string
+    # above, which gets printed in the error below, as well as in the help
+    with stats.timer('notebook'):
+        converter = _make_converter(infile, format, options)
+        outfiles = [converter.render()]
+        if format == 'html':
+            #Currently, conversion to html is a 2 step process, nb->rst->html
+            outfiles.append(os.path.abspath(rst2simplehtml(outfiles[0])))
+    return converter, outfiles
+
+def _make_converter(infile, format, options):
+    """Return the converter for format, with the given options set."""
+    if format not in converters:
+        raise SystemExit("Unknown format '%s', " % format +
+                "known formats are: " + known_formats)
+    converter = converters[format](infile)
+    for name, value in options.items():
+        if not hasattr(converter, name):
+            raise TypeError("Unknown converter option '%s'" % name)
+        setattr(converter, name, value)
+    return converter
+
+
+def convert_notebook(nb, format='rst', name='notebook', **options):
+    """Convert a notebook in memory, without writing any file.
+
+    Parameters
+    ----------
+    nb : string or NotebookNode
+      The notebook, as JSON or already read.
+    format : string
+      Any of the formats in `converters`.
+    name : string
+      Name of the notebook, without the .ipynb extension, which the figure
+      names are derived from.
+
+    Any other keyword arguments are converter options, as for `main`.  Only
+    SVG figures converted to PDF for latex go through temporary files, as
+    inkscape needs them.  A NotebookNode given as nb is left unchanged.
+
+    Returns
+    -------
+    (output, figures) : the converted document as unicode, and a dict
+    mapping the figure names, as the document refers to them, to their
+    contents.
+    """
+    with stats.timer('notebook'):
+        converter = _make_converter(name + '.ipynb', format, options)
+        converter.in_memory = True
+        if isinstance(nb, basestring):
+            from IPython.nbformat import current as nbformat
+            with stats.timer('read'):
+                nb = nbformat.reads(nb, 'json')
+        else:
+            # The conversion edits the cells, which belong to the caller
+            nb = copy.deepcopy(nb)
+        converter.nb = nb
+        output = converter.convert()
+        if format == 'html':
+            output = rst2html_body(output).decode('utf-8')
+    return output, converter.figure_data
+
+#-----------------------------------------------------------------------------
+# Incremental conversion
+#-----------------------------------------------------------------------------
+
+def docutils_version():
+    """Return the version of docutils, which renders rst to html."""
+    import docutils
+    return docutils.__version__
+
+# Version probes for the external tools each format depends on
+format_tools = {'html': [('docutils', docutils_version)],
+                'latex': [('pandoc', pandoc_version),
+                          ('inkscape', inkscape_version)]}
+# Manifest entries which must all be unchanged for a notebook to be skipped
+manifest_keys = ('input', 'format', 'converter', 'options', 'tools',
+                 'nbconvert', 'output_dir')
+# Converter options which only change how the output is made, not its
+# contents, and are left out of the manifest
+manifest_ignored_options = ('cell_workers', 'stream_input', 'stream_output',
+                            'svg_workers', 'batch_markdown', 'figure_store')
+_nbconvert_version = None
+
+
+def nbconvert_version():
+    """Return a hash of this script and of the LaTeX preamble.
+
+    Any change to either can change the output, so notebooks converted by a
+    different version are not considered up to date."""
+    global _nbconvert_version
+    if _nbconvert_version is None:
+        here = os.path.dirname(os.path.realpath(__file__))
+        parts = []
+        for fname in ('nbconvert.py', 'preamble.tex'):
+            with open(os.path.join(here, fname), 'rb') as f:
+                parts.append(f.read())
+        _nbconvert_version = content_key(*parts)
+    return _nbconvert_version
+
+
+def file_hash(fname):
+    """Return the sha1 hex digest of the contents of fname."""
+    digest = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_file(infile, format):
+    """Return the name of the build manifest of infile for the given format.
+
+    It is kept in the notebook's _files directory, next to its figures."""
+    files_dir = os.path.splitext(infile)[0] + '_files'
+    return os.path.join(files_dir, '.nbconvert-%s.json' % format)
+
+
+def read_manifest(fname):
+    """Return the manifest stored in fname, or None if there is none."""
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _tool_versions(format):
+    versions = {}
+    for name, probe in format_tools.get(format, []):
+        try:
+            versions[name] = probe()
+        except Exception:
+            # Not installed, any conversion needing it will fail loudly
+            versions[name] = None
+    return versions
+
+
+def _build_state(infile, format, options, old):
+    """Return what the manifest of infile records about its conversion.
+
+    The hash of the notebook is taken from the old manifest when the size and
+    modification time of the file haven't changed, like make would."""
+    st = os.stat(infile)
+    if (old and old.get('input_size') == st.st_size and
+        old.get('input_mtime') == st.st_mtime):
+        input_hash = old['input']
     else:
+        input_hash = file_hash(infile)
+    options = dict((name, value) for name, value in options.items()
+                   if name not in manifest_ignored_options)
+    if options.get('user_preamble'):
+        # The output depends on the content of this file, not its name
+        options['user_preamble'] = file_hash(options['user_preamble'])
+    state = dict(input=input_hash, input_size=st.st_size,
+                 input_mtime=st.st_mtime, format=format,
+                 converter=converters[format].__name__, options=options,
+                 tools=_tool_versions(format), nbconvert=nbconvert_version(),
+                 output_dir=os.getcwd())
+    # Compare exactly what would be read back from the manifest
+    return json.loads(json.dumps(state))
+
+
+def up_to_date(manifest, state):
+    """Whether a notebook with the given manifest needs no conversion.
+
+    That is if the manifest matches the current state, as returned by
+    _build_state, all the files it lists still exist, and the outputs are
+    still those of this notebook: another notebook with the same name, in
+    another directory, may have been saved over them since."""
+    if manifest is None or not manifest.get('outputs'):
+        return False
+    if any(manifest.get(key) != state[key] for key in manifest_keys):
+        return False
+    files = manifest['outputs'] + manifest.get('figures', [])
+    if not all(os.path.exists(f) for f in files):
+        return False
+    hashes = manifest.get('output_hashes')
+    return hashes == [file_hash(f) for f in manifest['outputs']]
+
+
+def build(infile, format='rst', **options):
+    """Convert infile, unless it is up to date with its build manifest.
+
+    The manifest records a hash of the notebook, the converter, its options,
+    the versions of nbconvert and of the external tools used, and the files
+    produced, with the hashes of the outputs.  When it shows that nothing changed since the last conversion,
+    and the output files are still there, the conversion is skipped.
+    Otherwise the notebook is converted and any figure from the previous
+    conversion which is no longer produced is removed.
+
+    Returns a tuple (outfile, converted), where converted is False if the
+    notebook was skipped.
+    """
+    if format not in converters:
         raise SystemExit("Unknown format '%s', " % format +
                 "known formats are: " + known_formats)
+    mfile = manifest_file(infile, format)
+    old = read_manifest(mfile)
+    state = _build_state(infile, format, options, old)
+    if up_to_date(old, state):
+        logging.info('%s is up to date' % infile)
+        return old['outputs'][-1], False
+
+    converter, outfiles = _convert(infile, format, options)
+    figures = [os.path.abspath(f) for f in converter.figures]
+    if old is not None:
+        _remove_stale_figures(mfile, old.get('figures', []), figures)
+    state.update(outputs=outfiles,
+                 output_hashes=[file_hash(f) for f in outfiles],
+                 figures=sorted(set(figures)))
+    makedirs(os.path.dirname(mfile))
+    atomic_write(mfile, json.dumps(state, indent=1, sort_keys=True))
+    return outfiles[-1], True
+
+
+def _remove_stale_figures(mfile, old_figures, figures):
+    """Remove the figures in old_figures which aren't in figures anymore.
+
+    Figures recorded by the manifests of other formats, in the same _files
+    directory, are kept."""
+    keep = set(figures)
+    for other in glob.glob(os.path.join(os.path.dirname(mfile),
+                                        '.nbconvert-*.json')):
+        if other != mfile:
+            keep.update((read_manifest(other) or {}).get('figures', []))
+    for fname in old_figures:
+        if fname in keep:
+            continue
+        try:
+            os.remove(fname)
+            logging.info('Removed stale figure %s' % fname)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+#-----------------------------------------------------------------------------
+# Batch conversion
+#-----------------------------------------------------------------------------
+
+def expand_infiles(paths):
+    """Expand a list of files, glob patterns and directories into notebooks.
+
+    Directories are walked recursively for ``.ipynb`` files (skipping
+    ``.ipynb_checkpoints``), glob patterns are expanded and plain files are
+    kept as given, see batch.expand_paths.
+    """
+    return [infile for infile, name in
+            batch.expand_paths(paths, ('.ipynb',), ('.ipynb_checkpoints',))]
+
+
+def _convert_one(args):
+    """Convert a single notebook for `convert_many`, trapping any error.
+
+    Returns a tuple (infile, error, seconds, converted, report), where error
+    is None on success or a formatted traceback, converted is False if the
+    notebook was up to date, and report is the stats report for this
+    notebook, or None if stats aren't collected.  This runs inside pool
+    workers, so everything returned must be picklable.
+    """
+    infile, format, incremental, collect_stats, options = args
+    start = time.time()
+    report = None
+    if collect_stats:
+        with stats.collect() as collector:
+            error, converted = _convert_trapped(infile, format, incremental,
+                                                options)
+        report = collector.report()
+    else:
+        error, converted = _convert_trapped(infile, format, incremental,
+                                            options)
+    return infile, error, time.time() - start, converted, report
+
+
+def _convert_trapped(infile, format, incremental, options):
+    if incremental:
+        result, error = batch.trap(build, infile, format, **options)
+        return error, error is not None or result[1]
+    return batch.trap(main, infile, format, **options)[1], True
+
+
+def enable_caches(cache_dir):
+    """Cache the results of pandoc and inkscape, and the rendered cells, in
+    subdirectories of cache_dir, see batch.open_cache.
+    """
+    enable_markdown_cache(batch.cache_path(cache_dir, 'markdown'))
+    enable_svg_cache(batch.cache_path(cache_dir, 'svg'))
+    enable_fragment_cache(batch.cache_path(cache_dir, 'fragments'))
+
+
+def _init_worker(markdown_dir, svg_dir, fragment_dir):
+    """Set up a `convert_many` pool worker."""
+    if markdown_dir is not None and markdown_cache is None:
+        enable_markdown_cache(markdown_dir)
+    if svg_dir is not None and svg_cache is None:
+        enable_svg_cache(svg_dir)
+    if fragment_dir is not None and fragment_cache is None:
+        enable_fragment_cache(fragment_dir)
+
+
+def convert_many(infiles, format='rst', jobs=1, incremental=False,
+                 stats_hook=None, **options):
+    """Convert many notebooks, fanning them out across a pool of processes
+    with batch.run.
+
+    Notebooks which would be saved to the same file are refused up front,
+    see `check_outputs`.
+
+    Parameters
+    ----------
+    infiles : list
+      Notebook files to convert.
+    format : string
+      Any of the formats in `converters`.
+    jobs : int
+      Number of worker processes, see batch.run.
+    incremental : bool
+      Skip the notebooks which are up to date with their build manifest, see
+      `build`.
+    stats_hook : callable
+      When stats are collected (see stats.enable), called as
+      stats_hook(infile, report) with the report of each notebook, as it is
+      done.  The reports of all the notebooks, including those converted in
+      worker processes, are also added to stats.current.
+
+    Any other keyword arguments are passed on to `main` as converter options.
+
+    Returns
+    -------
+    summary : dict
+      See batch.run, with the notebooks which were up to date under
+      'skipped'.
+    """
+    if format not in converters:
+        raise SystemExit("Unknown format '%s', " % format +
+                "known formats are: " + known_formats)
+    check_outputs(infiles, format)
+    collect_stats = stats.current is not None
+    tasks = [(infile, format, incremental, collect_stats, options)
+             for infile in infiles]
+
+    def merge_report(result):
+        infile, report = result[0], result[4]
+        if report is not None:
+            stats.current.merge(report)
+            if stats_hook is not None:
+                stats_hook(infile, report)
+    # Workers that aren't forked from this process (Windows) must set up the
+    # caches themselves.
+    cache_dirs = (markdown_cache.path if markdown_cache else None,
+                  svg_cache.path if svg_cache else None,
+                  fragment_cache.path if fragment_cache else None)
+    return batch.run(_convert_one, tasks, jobs, _init_worker, cache_dirs,
+                     on_result=merge_report)
+
+
+def print_summary(summary, stream=None):
+    """Print a short report of a `convert_many` run."""
+    batch.print_summary(summary, stream, 'notebooks')
+
+#-----------------------------------------------------------------------------
+# Watch mode
+#-----------------------------------------------------------------------------
+
+def watch(paths, format='rst', debounce=0.05, interval=0.25, stream=None,
+          **options):
+    """Convert notebooks, and convert them again whenever they are saved.
+
+    This keeps running until interrupted.  Working from a single process
+    saves the interpreter startup and imports on every conversion, and lets
+    the caches (kept in memory, unless set up already) skip the unchanged
+    cells.
+
+    Parameters
+    ----------
+    paths : list
+      Notebook files, glob patterns or directories, as for `expand_infiles`.
+      New notebooks showing up in the directories are picked up.
+    format : string
+      Any of the formats in `converters`.
+    debounce, interval : float
+      See watch.Watcher.
+    stream : file
+      Where a line is printed for every conversion (sys.stdout by default).
+
+    Changes are skipped, with an error logged, while notebooks would be
+    saved to the same file, see `check_outputs`.  Any other keyword
+    arguments are passed on to `main`.
+    """
+    from watch import Watcher
+    if stream is None:
+        stream = sys.stdout
+    if markdown_cache is None:
+        enable_markdown_cache(None)
+    if svg_cache is None:
+        enable_svg_cache(None)
+    if fragment_cache is None:
+        enable_fragment_cache(None)
+    dirs = [p for p in paths if not glob.has_magic(p)]
+    dirs += [os.path.dirname(p) or '.' for p in paths if glob.has_magic(p)]
+    watcher = Watcher(lambda: expand_infiles(paths), dirs, debounce=debounce,
+                      interval=interval)
+    try:
+        for infiles in itertools.chain([expand_infiles(paths)],
+                                       watcher.changes()):
+            try:
+                check_outputs(expand_infiles(paths), format)
+            except batch.OutputCollision as e:
+                # Keep watching, the notebooks may be renamed
+                logging.error(str(e))
+                print('SKIPPED: %s' % ', '.join(infiles), file=stream)
+                stream.flush()
+                continue
+            for infile in infiles:
+                start = time.time()
+                try:
+                    main(infile, format, **options)
+                except Exception:
+                    logging.error('Failed to convert %s:\n%s' %
+                                  (infile, traceback.format_exc()))
+                    print('FAILED: %s' % infile, file=stream)
+                else:
+                    print('Converted %s in %.0fms' %
+                          (infile, (time.time() - start) * 1000),
+                          file=stream)
+                stream.flush()
+    finally:
+        watcher.close()
 
 #-----------------------------------------------------------------------------
 # Script main
 #-----------------------------------------------------------------------------
 
 if __name__ == '__main__':
+    import argparse
     parser = argparse.ArgumentParser(description=__doc__,
             formatter_class=argparse.RawTextHelpFormatter)
     # TODO: consider passing file like object around, rather than filenames
     # would allow us to process stdin, or even http streams
     #parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
 
-    #Require a filename as a positional argument
-    parser.add_argument('infile', nargs=1)
+    #Require at least one filename as a positional argument
+    parser.add_argument('infile', nargs='+',
+                        help='Notebook files, glob patterns or directories')
     parser.add_argument('-f', '--format', default='rst',
                         help='Output format. Supported formats: \n' +
                         known_formats)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of notebooks to convert in parallel in\n'
+                        'batch mode (0 means one per CPU).')
+    parser.add_argument('--cell-workers', type=int, default=1,
+                        help='Number of cells of a notebook to render in\n'
+                        'parallel, with the same output.')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory for a persistent cache of pandoc and\n'
+                        'inkscape results and of rendered cells, shared by\n'
+                        'all conversions.')
+    parser.add_argument('--figure-naming', choices=['counter', 'hash'],
+                        default='counter',
+                        help='Name figure files by a counter (default) or by\n'
+                        'a hash of their content, which writes identical\n'
+                        'figures only once.')
+    parser.add_argument('--figure-store', default=None,
+                        help='Directory where figures are stored once for all\n'
+                        'notebooks and hard-linked into each _files dir.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the notebook and write the output one cell\n'
+                        'at a time, for notebooks too large to hold in memory.')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Skip notebooks unchanged since their last\n'
+                        'incremental conversion, and remove stale figures.')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='Keep running, and convert the notebooks again\n'
+                        'as soon as they are saved.')
+    parser.add_argument('--tool-timeout', type=float, default=None,
+                        help='Seconds after which a pandoc, inkscape or\n'
+                        'rst2html call is killed (default %i).' %
+                        tools.default_timeout)
+    parser.add_argument('--stats', action='store_true',
+                        help='Print a JSON report of the time, calls, bytes\n'
+                        'written and subprocesses of each conversion stage.')
     args = parser.parse_args()
-    main(infile=args.infile[0], format=args.format)
+    if args.stats:
+        stats.enable()
+    if args.cache_dir:
+        enable_caches(args.cache_dir)
+    if args.tool_timeout:
+        tools.default_timeout = args.tool_timeout
+    options = dict(figure_naming=args.figure_naming,
+                   figure_store=args.figure_store,
+                   stream_input=args.stream,
+                   stream_output=args.stream,
+                   cell_workers=args.cell_workers)
+    if args.watch:
+        try:
+            watch(args.infile, format=args.format, **options)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    infiles = expand_infiles(args.infile)
+    failed = False
+    if len(infiles) == 1 and infiles[0] == args.infile[0]:
+        main(infile=infiles[0], format=args.format,
+             incremental=args.incremental, **options)
+    else:
+        summary = convert_many(infiles, format=args.format, jobs=args.jobs,
+                               incremental=args.incremental, **options)
+        # Leave stdout to the stats report
+        print_summary(summary, sys.stderr if args.stats else sys.stdout)
+        failed = bool(summary['failed'])
+    if args.stats:
+        print(json.dumps(stats.current.report(), indent=1, sort_keys=True))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,175 @@
+"""
+Incremental reader for large notebook files.
+
+nbformat.read parses the whole JSON document, base64 images included, before
+returning anything.  The reader here only parses the top-level fields up
+front, and then decodes the cells one at a time as they are iterated over:
+
+with open('huge.ipynb') as f:
+    nb = read(f)
+    for worksheet in nb.worksheets:
+        for cell in worksheet.cells:
+            ...
+
+so that memory use is bounded by the largest cell rather than by the size of
+the notebook.  The worksheets and their cells are one-shot iterators which
+must be consumed in order, and the file must stay open until they are.  Only
+v3 notebooks whose nbformat field comes before the worksheets (as IPython
+writes them, with sorted keys) can be streamed; other notebooks are read in
+full, as nbformat.read would.
+"""
+
+import codecs
+import json
+
+from IPython.nbformat import current as nbformat
+from IPython.nbformat.current import NotebookNode
+from IPython.nbformat.v3.nbbase import from_dict
+
+
+class _Scanner(object):
+    """Decode JSON values one at a time from a file, reading it in chunks."""
+
+    chunk_size = 2**16
+
+    def __init__(self, f):
+        self.f = f
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = u''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size):
+        """Append about size characters from the file to the buffer.
+
+        Returns False if the file is exhausted."""
+        if self.eof:
+            return False
+        data = self.f.read(size)
+        self.eof = not data
+        self.buf = self.buf[self.pos:] + self.utf8.decode(data, self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        """Return the next non-whitespace character, without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill(self.chunk_size):
+                raise ValueError('Unexpected end of notebook file')
+
+    def expect(self, chars):
+        """Consume the next non-whitespace character, which must be in chars.
+        """
+        c = self.peek()
+        if c not in chars:
+            raise ValueError('Expected %r in notebook file, found %r' %
+                             (chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode and return the next JSON value."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                obj, end = None, None
+            # A value running up to the end of the buffer may be a truncated
+            # number, so it only counts once the file is exhausted.
+            if end is not None and (end < len(self.buf) or self.eof):
+                self.pos = end
+                return obj
+            if not self.fill(size):
+                if end is None:
+                    raise ValueError('Invalid JSON value in notebook file')
+            # Grow the reads so that huge values are not re-parsed too often
+            size *= 2
+
+    def items(self):
+        """Iterate over the (key, scanner) pairs of the next JSON object.
+
+        The value for each key must be consumed by the caller, with value()
+        or otherwise, before moving on to the next key."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key, self
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """Iterate over the elements of the next JSON array, as items() does.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self
+            if self.expect(',]') == ']':
+                return
+
+
+def _cell_node(d):
+    """Turn a cell dict into a NotebookNode, exactly as nbformat.read does.
+    """
+    nb = nbformat.v3.to_notebook_json({'worksheets': [{'cells': [d]}]})
+    return nb.worksheets[0].cells[0]
+
+
+def _iter_cells(scanner, worksheet):
+    for key, s in scanner.items():
+        if key == 'cells':
+            for s in scanner.elements():
+                yield _cell_node(s.value())
+        else:
+            worksheet[key] = from_dict(s.value())
+
+
+def _iter_worksheets(scanner):
+    for s in scanner.elements():
+        worksheet = NotebookNode()
+        worksheet.cells = _iter_cells(scanner, worksheet)
+        yield worksheet
+        # Whatever the caller didn't consume is skipped
+        for cell in worksheet.cells:
+            pass
+
+
+def read(f):
+    """Read a notebook from the open file f, decoding cells lazily.
+
+    Returns a NotebookNode whose worksheets, and the cells of each worksheet,
+    are iterators.  Worksheet fields stored after the cells in the file
+    (such as metadata) are only set once its cells have been consumed.
+    """
+    scanner = _Scanner(f)
+    nb = NotebookNode()
+    for key, s in scanner.items():
+        if key != 'worksheets':
+            nb[key] = from_dict(s.value())
+            continue
+        nbf = nb.get('nbformat', 1)
+        if nbf != 3:
+            # Not something we can stream, read the whole file the usual way
+            f.seek(0)
+            return nbformat.read(f, 'json')
+        nb.worksheets = _iter_worksheets(scanner)
+        break
+
+    if 'worksheets' not in nb:
+        f.seek(0)
+        return nbformat.read(f, 'json')
+    return nbformat.v3.convert_to_this_nbformat(
+        nb, orig_version=3, orig_minor=nb.get('nbformat_minor', 0))
@@ -1,21 +1,275 @@
 #!/usr/bin/env python
 """
 A minimal front end to the Docutils Publisher, producing an ipython notebook.
+
+rst2ipynb.py --batch [-j JOBS] [-o OUTDIR] path [path ...]
+
+converts many files, and the .rst files found in directories, in a single
+process (or a pool of them, with -j) which sets up docutils only once.  Each
+notebook is written next to its source, or into OUTDIR, where the files
+found in a directory keep their place relative to that directory.
+
+With --cache-dir DIR, the notebooks are cached in DIR (in a notebooks
+subdirectory, so DIR can also be nbconvert's --cache-dir), keyed by their
+source, and the documents which haven't changed since they were last
+converted skip docutils altogether.  --cache-size caps the size of the
+cache, and --clear-cache empties it.
 """
 
+import logging
+import os
+import sys
+import time
+
 import docutils.readers.standalone
 import docutils.parsers.rst
 import docutils.core
 import rst2ipynblib
 from docutils.core import publish_cmdline
+from docutils.frontend import OptionParser
+from docutils.utils import DependencyList
+
+import batch
+from cache import atomic_write, content_key
 
 description = ('Generates an ipython notebook from standalone '
                'reStructuredText source. ' +
                docutils.core.default_description)
 
-publish_cmdline(reader=docutils.readers.standalone.Reader(),
-                          parser=docutils.parsers.rst.Parser(),
-                          writer=rst2ipynblib.Writer(),
-                          enable_exit_status=1,
-                          usage=docutils.core.default_usage,
-                          description=description)
+# Extensions of the files converted from directories
+source_extensions = ('.rst',)
+
+_writer_version = None
+
+
+def writer_version():
+    """Return a hash of the writer, and the IPython version it builds the
+    notebooks with.  Cached notebooks made by another version are stale."""
+    global _writer_version
+    if _writer_version is None:
+        import IPython
+        with open(os.path.splitext(rst2ipynblib.__file__)[0] + '.py',
+                  'rb') as f:
+            _writer_version = content_key(f.read(), IPython.__version__)
+    return _writer_version
+
+
+def expand_infiles(paths):
+    """Expand a list of files, glob patterns and directories into the files
+    to convert.
+
+    Returns a list of (infile, name) pairs, where name is the path of the
+    file relative to the directory it was found in, or its base name for
+    files given as such.  See `output_file` and batch.expand_paths.
+    """
+    return batch.expand_paths(paths, source_extensions)
+
+
+def output_file(infile, name, outdir=None):
+    """Return the notebook file infile, found as name, converts to."""
+    if outdir is None:
+        return os.path.splitext(infile)[0] + '.ipynb'
+    return os.path.join(outdir, os.path.splitext(name)[0] + '.ipynb')
+
+
+class BatchConverter(object):
+    """Convert rst files to notebooks, with a single docutils setup.
+
+    The settings (including those from the docutils configuration files),
+    the reader, the parser and the writer are made once and reused for
+    every document.  The notebooks are written to their file as they are
+    translated (see rst2ipynblib.CellStream), so that large documents are
+    never held in memory as a whole notebook.  Errors are raised rather
+    than reported.
+
+    Parameters
+    ----------
+    settings_overrides : dict
+      Docutils settings to use instead of the defaults.
+    cache_dir : string
+      Directory to cache the notebooks in, see `convert` and
+      batch.open_cache.
+    cache_size : int
+      Size cap of the cache, in bytes.
+    """
+
+    def __init__(self, settings_overrides=None, cache_dir=None,
+                 cache_size=256 * 2**20):
+        self.reader = docutils.readers.standalone.Reader()
+        self.parser = docutils.parsers.rst.Parser()
+        self.writer = rst2ipynblib.Writer()
+        defaults = dict(traceback=True)
+        defaults.update(settings_overrides or {})
+        option_parser = OptionParser(
+            components=(self.parser, self.reader, self.writer),
+            defaults=defaults, read_config_files=True)
+        self.settings = option_parser.get_default_values()
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = batch.open_cache(cache_dir, 'notebooks',
+                                          max_items=0, max_bytes=cache_size)
+            # Settings which can change the output, leaving out the streams
+            # and objects docutils adds
+            settings = sorted(
+                (name, value) for name, value in vars(self.settings).items()
+                if isinstance(value, (basestring, int, float, list, tuple,
+                                      type(None))))
+            self.settings_key = repr(settings)
+
+    def cache_key(self, infile, source):
+        """Return the cache key for the rst source read from infile."""
+        # Included files are looked for relative to the source
+        return content_key(source, os.path.dirname(os.path.abspath(infile)),
+                           docutils.__version__, writer_version(),
+                           self.settings_key)
+
+    def convert(self, infile, outfile):
+        """Convert the rst file infile to the notebook file outfile.
+
+        With a cache, the notebook is taken from it when the source (and any
+        file it includes) hasn't changed since it was cached.  Returns
+        whether the document had to be converted.
+        """
+        with open(infile, 'rb') as f:
+            source = f.read()
+        key = None
+        if self.cache is not None:
+            key = self.cache_key(infile, source)
+            # The notebook is stale if a file the document included changed
+            notebook = batch.get_cached(self.cache, key)
+            if notebook is not None:
+                atomic_write(outfile, notebook)
+                return False
+        batch.makedirs(os.path.dirname(outfile))
+
+        self.settings.record_dependencies = DependencyList()
+
+        def publish(f):
+            self.writer.stream = f
+            try:
+                docutils.core.publish_string(
+                    source, source_path=infile, destination_path=outfile,
+                    reader=self.reader, parser=self.parser,
+                    writer=self.writer, settings=self.settings)
+            finally:
+                self.writer.stream = None
+        atomic_write(outfile, publish)
+        if key is not None:
+            with open(outfile, 'rb') as f:
+                notebook = f.read()
+            batch.set_cached(self.cache, key, notebook,
+                             self.settings.record_dependencies.list)
+        return True
+
+
+# The BatchConverter of a pool worker, see _init_worker
+_converter = None
+
+
+def _init_worker(*args):
+    global _converter
+    _converter = BatchConverter(*args)
+
+
+def _convert_one(args):
+    """Convert a single file for `convert_many`, trapping any error.
+
+    Returns (infile, error, seconds, converted), error being None or the
+    traceback, and converted False when the notebook came from the cache."""
+    infile, outfile = args
+    start = time.time()
+    converted, error = batch.trap(_converter.convert, infile, outfile)
+    return infile, error, time.time() - start, error is not None or converted
+
+
+def convert_many(paths, outdir=None, jobs=1, settings_overrides=None,
+                 cache_dir=None, cache_size=256 * 2**20):
+    """Convert many rst files, and those found in directories, to notebooks,
+    with batch.run.
+
+    Files which would be converted to the same notebook, such as
+    x/index.rst and y/index.rst given as files with an outdir, are refused
+    up front, see batch.check_outputs.
+
+    Parameters
+    ----------
+    paths : list
+      Files and directories to convert, see `expand_infiles`.
+    outdir : string
+      Directory for the notebooks, which are otherwise written next to
+      their source.
+    jobs : int
+      Number of worker processes, see batch.run.
+    settings_overrides : dict
+      Docutils settings, see `BatchConverter`.
+    cache_dir, cache_size
+      Cache of the notebooks, see `BatchConverter`.
+
+    Returns
+    -------
+    summary : dict
+      See batch.run, with the files whose notebook came from the cache
+      under 'cached'.
+    """
+    global _converter
+    tasks = [(infile, output_file(infile, name, outdir))
+             for infile, name in expand_infiles(paths)]
+    batch.check_outputs(tasks)
+    try:
+        return batch.run(_convert_one, tasks, jobs, _init_worker,
+                         (settings_overrides, cache_dir, cache_size),
+                         unchanged='cached')
+    finally:
+        _converter = None
+
+
+def print_summary(summary, stream=None):
+    """Print a short report of a `convert_many` run."""
+    batch.print_summary(summary, stream, 'files', 'cached', 'from cache')
+
+
+def main_batch(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='rst2ipynb.py --batch',
+        description='Convert many rst files to notebooks in one process.')
+    parser.add_argument('paths', nargs='*',
+                        help='rst files, or directories to search for .rst '
+                        'files')
+    parser.add_argument('-o', '--outdir', default=None,
+                        help='Directory for the notebooks (default: next to '
+                        'the sources)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes (0: one per CPU)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory to cache the notebooks in')
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help='Size cap of the cache, in MB (default 256)')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Empty the cache before converting anything')
+    args = parser.parse_args(argv)
+    if args.clear_cache:
+        if args.cache_dir is None:
+            parser.error('--clear-cache needs --cache-dir')
+        batch.open_cache(args.cache_dir, 'notebooks').clear()
+        if not args.paths:
+            return 0
+    elif not args.paths:
+        parser.error('no files to convert')
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    summary = convert_many(args.paths, args.outdir, args.jobs,
+                           cache_dir=args.cache_dir,
+                           cache_size=args.cache_size * 2**20)
+    print_summary(summary)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--batch']:
+        sys.exit(main_batch(sys.argv[2:]))
+    publish_cmdline(reader=docutils.readers.standalone.Reader(),
+                              parser=docutils.parsers.rst.Parser(),
+                              writer=rst2ipynblib.Writer(),
+                              enable_exit_status=1,
+                              usage=docutils.core.default_usage,
+                              description=description)
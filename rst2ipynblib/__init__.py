@@ -1,11 +1,15 @@
 """
 Simple ipython notebook document tree Writer.
 
+With a file object as the stream attribute of the Writer, the notebook is
+written to it cell by cell as the document is translated, rather than built
+in memory and returned as the output.
 """
 
 __docformat__ = 'reStructuredText'
 
 
+import json
 import sys
 import os
 import os.path
@@ -20,6 +24,8 @@ from docutils.math import unichar2tex, pick_math_environment
 from docutils.math.latex2mathml import parse_latex_math
 from docutils.math.math2html import math2html
 from IPython.nbformat import current as nbformat
+from IPython.nbformat.v3.nbjson import BytesEncoder
+from IPython.nbformat.v3.rwbase import split_lines
 
 
 class Writer(writers.Writer):
@@ -32,16 +38,68 @@ class Writer(writers.Writer):
     def get_transforms(self):
         return writers.Writer.get_transforms(self) + [writer_aux.Admonitions]
 
+    # File object the notebook is written to while it is translated, in
+    # which case the output is empty
+    stream = None
+
     def __init__(self):
         writers.Writer.__init__(self)
         self.translator_class = IPYNBTranslator
 
     def translate(self):
-        self.visitor = visitor = self.translator_class(self.document)
+        self.visitor = visitor = self.translator_class(self.document,
+                                                       self.stream)
         self.document.walkabout(visitor)
         for attr in self.visitor_attributes:
             setattr(self, attr, getattr(visitor, attr))
-        self.output = '{0}'.format(nbformat.writes(visitor.nb, 'ipynb'))
+        if self.stream is None:
+            self.output = '{0}'.format(nbformat.writes(visitor.nb, 'ipynb'))
+        else:
+            visitor.close()
+            self.output = ''
+
+
+class CellStream(object):
+    """Write the JSON of a notebook to a file one cell at a time.
+
+    The result is the same as nbformat.writes(nb, 'ipynb') for the notebook
+    with the cells written, but only one cell is ever held in memory.  The
+    cells of nb, which gives the rest of the notebook, are ignored.  The
+    cells written are modified, and can't be used afterwards.
+    """
+
+    def __init__(self, stream, nb):
+        self.stream = stream
+        self.ncells = 0
+        ws = nb.worksheets[0]
+        cells, ws.cells = ws.cells, []
+        try:
+            skeleton = '{0}'.format(nbformat.writes(nb, 'ipynb'))
+        finally:
+            ws.cells = cells
+        head, self.tail = skeleton.split('"cells": []', 1)
+        # The indentation of the cells, and of the closing bracket
+        self.indent = head[head.rindex('\n') + 1:]
+        self.stream.write(head + '"cells": [')
+        # Notebook holding the cell being written, for split_lines
+        self._holder = nbformat.new_notebook(
+            worksheets=[nbformat.new_worksheet()])
+
+    def write(self, cell):
+        self._holder.worksheets[0].cells = [cell]
+        split_lines(self._holder)
+        text = json.dumps(cell, cls=BytesEncoder, indent=1, sort_keys=True,
+                          separators=(',', ': '))
+        self.stream.write('\n' if self.ncells == 0 else ',\n')
+        prefix = self.indent + ' '
+        self.stream.write('\n'.join(prefix + line
+                                    for line in text.split('\n')))
+        self.ncells += 1
+
+    def close(self):
+        if self.ncells:
+            self.stream.write('\n' + self.indent)
+        self.stream.write(']' + self.tail)
 
 
 class IPYNBTranslator(nodes.GenericNodeVisitor):
@@ -49,7 +107,7 @@ class IPYNBTranslator(nodes.GenericNodeVisitor):
     """
     """
 
-    def __init__(self, document):
+    def __init__(self, document, stream=None):
         nodes.NodeVisitor.__init__(self, document)
         self.settings = settings = document.settings
         lcode = settings.language_code
@@ -61,6 +119,9 @@ class IPYNBTranslator(nodes.GenericNodeVisitor):
         self.section_level = 0
         ws = nbformat.new_worksheet()
         self.nb = nbformat.new_notebook(worksheets=[ws])
+        self.cell_stream = None
+        if stream is not None:
+            self.cell_stream = CellStream(stream, self.nb)
 
     def astext(self):
         return '{0}'.format(nbformat.writes(self.nb, 'ipynb'))
@@ -69,7 +130,14 @@ class IPYNBTranslator(nodes.GenericNodeVisitor):
         return p == "Unknown interpreted text role \"ref\"."
 
     def add_cell(self, cell):
-        self.nb.worksheets[0].cells.append(cell)
+        if self.cell_stream is not None:
+            self.cell_stream.write(cell)
+        else:
+            self.nb.worksheets[0].cells.append(cell)
+
+    def close(self):
+        """Finish writing the notebook to the stream."""
+        self.cell_stream.close()
 
     def visit_literal_block(self, node):
         raw_text = node.astext()
@@ -80,6 +148,7 @@ class IPYNBTranslator(nodes.GenericNodeVisitor):
                                     if line.startswith('>>>')])
         c = nbformat.new_code_cell(input=processed_text)
         self.add_cell(c)
+        raise nodes.SkipNode
 
     def visit_paragraph(self, node):
         text = node.astext()
@@ -94,6 +163,7 @@ class IPYNBTranslator(nodes.GenericNodeVisitor):
         if not self.is_ref_error_paragraph(text):
             p = nbformat.new_text_cell('markdown', source=text)
             self.add_cell(p)
+        raise nodes.SkipNode
 
 
     def visit_section(self, node):
@@ -110,15 +180,24 @@ class IPYNBTranslator(nodes.GenericNodeVisitor):
         h = nbformat.new_heading_cell(source=node.astext(),
                                       level=heading_level)
         self.add_cell(h)
+        raise nodes.SkipNode
 
     def default_visit(self, node):
-        node_class = node.__class__.__name__
-        #print '*default_visit', node_class
-        #if node_class in ['reference','paragraph','literal_block','title']:
-        if node_class in []:
-            print '*default_visit', node_class
-            print node.astext()
+        pass
 
     def default_departure(self, node):
-        #print '*default depart', node.__class__.__name__
         pass
+
+    def skip_node(self, node):
+        raise nodes.SkipNode
+
+
+# Cells are only made from paragraphs, titles and literal blocks, which use
+# the text of all their children.  Other text elements and inline nodes
+# can't hold any of them, so they are skipped along with their children.
+for _name in nodes.node_class_names:
+    _cls = getattr(nodes, _name)
+    if (issubclass(_cls, (nodes.Text, nodes.TextElement, nodes.Inline)) and
+            'visit_' + _name not in IPYNBTranslator.__dict__):
+        setattr(IPYNBTranslator, 'visit_' + _name,
+                IPYNBTranslator.__dict__['skip_node'])
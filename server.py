@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+"""Serve notebook conversions over HTTP, on localhost or a UNIX socket.
+
+Converting from a long-running process saves the interpreter startup and the
+IPython imports on every conversion.  The conversions run in a pool of
+worker processes, started once, so that a crashing or stuck conversion can't
+take the server down.  They are done in memory, see
+nbconvert.convert_notebook.
+
+Endpoints:
+
+POST /convert?format=latex&name=analysis
+  The request body is the notebook JSON.  The optional name is used for the
+  output and figure files (default: 'notebook'), and figure_naming and
+  raw_as_verbatim can also be given as converter options.  Answers with a
+  JSON object with the converted document in 'output' and the figures in
+  'figures', mapping their names, as referred to by the document, to their
+  base64-encoded content.
+
+GET /health
+  Answers 200 with {"status": "ok"} while the server accepts conversions,
+  and 503 with an 'error' when every request slot is taken or some of the
+  worker processes have died.
+
+GET /metrics
+  Request counts by status, timeouts, requests in progress, conversion time.
+
+Errors are answered with a JSON object with an 'error' message, with status
+400 for a bad request, 413 if the notebook is too large, 422 if the
+conversion failed, 503 when too many requests are in progress and 504 when
+the conversion took too long.
+
+Usage:
+  python server.py [--port 8642 | --socket /path/to/socket] [options]
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import BaseHTTPServer
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import SocketServer
+import threading
+import time
+import traceback
+import urlparse
+
+import nbconvert
+
+
+def _figure_naming(value):
+    if value not in ('counter', 'hash'):
+        raise ValueError("figure_naming must be 'counter' or 'hash'")
+    return value
+
+# Converter options which may be given in the query string, with the
+# function parsing their value, which raises ValueError for a bad one
+request_options = {'figure_naming': _figure_naming,
+                   'raw_as_verbatim': lambda v: v.lower() in ('1', 'true')}
+
+
+# Queue on which a pool worker reports the tasks it starts, see _run_task
+_started_queue = None
+
+
+def _init_worker(cache_dir, started_queue=None):
+    """Set up the caches of a pool worker."""
+    global _started_queue
+    _started_queue = started_queue
+    if cache_dir:
+        nbconvert.enable_caches(cache_dir)
+    else:
+        nbconvert.enable_markdown_cache(None)
+        nbconvert.enable_svg_cache(None)
+        nbconvert.enable_fragment_cache(None)
+
+
+def convert_notebook(nb_json, format, name='notebook', options=None):
+    """Convert the notebook nb_json (a string).
+
+    Returns a dict with the converted document as 'output' and the figures
+    as 'figures', or with an 'error' message if the conversion failed.  This
+    runs in the pool workers, so the results must be picklable.
+    """
+    try:
+        output, figures = nbconvert.convert_notebook(nb_json, format, name,
+                                                     **(options or {}))
+    except Exception:
+        logging.debug(traceback.format_exc())
+        return dict(error=traceback.format_exc().strip().splitlines()[-1])
+    return dict(output=output,
+                figures=dict((fname, base64.b64encode(data))
+                             for fname, data in figures.items()))
+
+
+def _run_task(task_id, func, args):
+    """Run func(*args) in a pool worker, telling WorkerPool it started."""
+    _started_queue.put(task_id)
+    return func(*args)
+
+
+class WorkerPool(object):
+    """Pool of warm worker processes, replaced when a conversion hangs.
+
+    multiprocessing can't stop a single task, so when one times out the pool
+    is retired: it takes no new tasks, and it is terminated once the other
+    conversions it was running have had the time to finish.
+
+    The timeout only counts from when a worker starts on the task, so that
+    the requests waiting for a free worker don't time out, and don't get a
+    healthy pool retired.
+    """
+
+    def __init__(self, workers, timeout, cache_dir=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.restarts = 0
+        self._lock = threading.Lock()
+        # The tasks not started yet, by id, with their pool and the event
+        # set when they start, or when their pool is terminated first
+        self._waiting = {}
+        self._abandoned = set()
+        self._task_ids = itertools.count()
+        self._started = multiprocessing.Queue()
+        listener = threading.Thread(target=self._listen)
+        listener.daemon = True
+        listener.start()
+        self.pool = self._new_pool()
+
+    def _new_pool(self):
+        return multiprocessing.Pool(self.workers, _init_worker,
+                                    (self.cache_dir, self._started))
+
+    def _listen(self):
+        """Set the events of the tasks as the workers start them."""
+        while True:
+            task_id = self._started.get()
+            if task_id is None:
+                return
+            with self._lock:
+                waiting = self._waiting.pop(task_id, None)
+            if waiting is not None:
+                waiting[1].set()
+
+    def run(self, func, args):
+        """Run func(*args) in a worker, raising multiprocessing.TimeoutError
+        if it doesn't finish in time once started."""
+        started = threading.Event()
+        with self._lock:
+            pool = self.pool
+            task_id = next(self._task_ids)
+            self._waiting[task_id] = (pool, started)
+        result = pool.apply_async(_run_task, (task_id, func, args))
+        try:
+            started.wait()
+            if task_id in self._abandoned:
+                # Its pool was terminated before getting to it
+                raise multiprocessing.TimeoutError()
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self._retire(pool)
+            raise
+        finally:
+            with self._lock:
+                self._waiting.pop(task_id, None)
+                self._abandoned.discard(task_id)
+
+    def alive_workers(self):
+        """Return the number of live worker processes in the current pool."""
+        with self._lock:
+            pool = self.pool
+        # multiprocessing.Pool has no public list of its processes
+        return sum(process.is_alive() for process in pool._pool)
+
+    def _retire(self, pool):
+        with self._lock:
+            if self.pool is not pool:
+                # Already retired because of another request
+                return
+            self.pool = self._new_pool()
+            self.restarts += 1
+        pool.close()
+
+        def terminate():
+            time.sleep(self.timeout)
+            pool.terminate()
+            pool.join()
+            self._abandon(pool)
+        thread = threading.Thread(target=terminate)
+        thread.daemon = True
+        thread.start()
+
+    def _abandon(self, pool):
+        """Release the requests waiting for pool to start their task."""
+        with self._lock:
+            for task_id, (task_pool, started) in self._waiting.items():
+                if task_pool is pool:
+                    self._abandoned.add(task_id)
+                    del self._waiting[task_id]
+                    started.set()
+
+    def close(self):
+        with self._lock:
+            pool = self.pool
+            pool.terminate()
+            pool.join()
+        self._abandon(pool)
+        self._started.put(None)
+
+
+class Metrics(object):
+    """Counters reported by /metrics."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.requests = {}
+        self.in_progress = 0
+        self.conversions = 0
+        self.conversion_time = 0.0
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.in_progress += 1
+
+    def finished(self, status, seconds=None):
+        with self._lock:
+            self.in_progress -= 1
+            self.requests[status] = self.requests.get(status, 0) + 1
+            if seconds is not None:
+                self.conversions += 1
+                self.conversion_time += seconds
+
+    def report(self):
+        with self._lock:
+            return dict(uptime=time.time() - self.start,
+                        requests=dict((str(status), count) for status, count
+                                      in self.requests.items()),
+                        in_progress=self.in_progress,
+                        conversions=self.conversions,
+                        conversion_time=self.conversion_time)
+
+
+class ConversionHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Don't let slow clients hold a thread forever
+    timeout = 60
+
+    def address_string(self):
+        # UNIX sockets have no client address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        logging.info('%s %s' % (self.address_string(), format % args))
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        app = self.server.app
+        path = urlparse.urlparse(self.path).path
+        if path == '/health':
+            workers = app.pool.alive_workers()
+            errors = []
+            if workers < app.pool.workers:
+                errors.append('%i of %i workers alive' % (workers,
+                                                          app.pool.workers))
+            if app.slots.acquire(False):
+                app.slots.release()
+            else:
+                errors.append('Too many requests in progress')
+            if errors:
+                self.send_json(503, dict(status='unavailable',
+                                         workers=workers,
+                                         error='; '.join(errors)))
+            else:
+                self.send_json(200, dict(status='ok', workers=workers))
+        elif path == '/metrics':
+            metrics = app.metrics.report()
+            metrics.update(pool_restarts=app.pool.restarts,
+                           max_requests=app.max_requests)
+            self.send_json(200, metrics)
+        else:
+            self.send_json(404, dict(error='Not found'))
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != '/convert':
+            self.send_json(404, dict(error='Not found'))
+            return
+        app = self.server.app
+        if not app.slots.acquire(False):
+            app.metrics.started()
+            app.metrics.finished(503)
+            self.send_json(503, dict(error='Too many requests in progress'))
+            return
+        app.metrics.started()
+        status, seconds = 500, None
+        try:
+            start = time.time()
+            status, response = self.convert(app, url)
+            if status == 200:
+                seconds = time.time() - start
+            self.send_json(status, response)
+        finally:
+            app.slots.release()
+            app.metrics.finished(status, seconds)
+
+    def convert(self, app, url):
+        """Do the conversion for a POST, returning (status, response)."""
+        query = dict(urlparse.parse_qsl(url.query))
+        format = query.pop('format', 'rst')
+        if format not in nbconvert.converters:
+            return 400, dict(error='Unknown format %r' % format)
+        name = os.path.basename(query.pop('name', 'notebook')) or 'notebook'
+        options = {}
+        for key, value in query.items():
+            if key not in request_options:
+                return 400, dict(error='Unknown option %r' % key)
+            try:
+                options[key] = request_options[key](value)
+            except ValueError as e:
+                return 400, dict(error=str(e))
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            return 411, dict(error='Content-Length required')
+        if length < 0:
+            return 400, dict(error='Negative Content-Length')
+        if length > app.max_size:
+            return 413, dict(error='Notebook larger than %i bytes' %
+                             app.max_size)
+        nb_json = self.rfile.read(length)
+        try:
+            result = app.pool.run(convert_notebook,
+                                  (nb_json, format, name, options))
+        except multiprocessing.TimeoutError:
+            return 504, dict(error='Conversion took more than %gs' %
+                             app.pool.timeout)
+        if 'error' in result:
+            return 422, result
+        return 200, result
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixServer(SocketServer.ThreadingMixIn,
+                           SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class ConversionServer(object):
+    """The conversion server, see the module docstring.
+
+    Parameters
+    ----------
+    port : int
+      Port to listen to on localhost, unless socket is given.  0 picks a free
+      port, see self.address.
+    socket : string
+      Path of a UNIX socket to listen to.
+    workers : int
+      Number of worker processes (default: one per CPU).
+    max_requests : int
+      Number of requests converted or waiting for a worker at once, beyond
+      which requests are turned down (default: twice the workers).
+    timeout : float
+      Seconds after which a conversion is abandoned, not counting the time
+      it waited for a free worker.
+    max_size : int
+      Largest notebook accepted, in bytes.
+    cache_dir : string
+      Directory for the pandoc, inkscape and cell caches of the workers,
+      which are otherwise kept in memory.
+    """
+
+    def __init__(self, port=8642, socket=None, workers=None,
+                 max_requests=None, timeout=60.0, max_size=256 * 2**20,
+                 cache_dir=None):
+        workers = workers or multiprocessing.cpu_count()
+        self.max_requests = max_requests or 2 * workers
+        self.max_size = max_size
+        self.slots = threading.BoundedSemaphore(self.max_requests)
+        self.metrics = Metrics()
+        self.pool = WorkerPool(workers, timeout, cache_dir)
+        if socket is not None:
+            if os.path.exists(socket):
+                os.unlink(socket)
+            self.httpd = _ThreadingUnixServer(socket, ConversionHandler)
+        else:
+            self.httpd = _ThreadingHTTPServer(('127.0.0.1', port),
+                                              ConversionHandler)
+        self.httpd.app = self
+        self.address = self.httpd.server_address
+
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.close()
+
+    def shutdown(self):
+        """Stop serve_forever, from another thread."""
+        self.httpd.shutdown()
+
+    def close(self):
+        self.httpd.server_close()
+        self.pool.close()
+        if isinstance(self.address, basestring) and os.path.exists(
+                self.address):
+            os.unlink(self.address)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+            formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--port', type=int, default=8642,
+                        help='Port to listen to on localhost (default 8642)')
+    parser.add_argument('--socket', default=None,
+                        help='UNIX socket to listen to, instead of a port')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='Number of worker processes (default: CPUs)')
+    parser.add_argument('--max-requests', type=int, default=None,
+                        help='Requests in progress beyond which new ones are\n'
+                        'turned down (default: twice the workers)')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Seconds after which a conversion is abandoned')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory for persistent caches')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = ConversionServer(port=args.port, socket=args.socket,
+                              workers=args.workers,
+                              max_requests=args.max_requests,
+                              timeout=args.timeout, cache_dir=args.cache_dir)
+    logging.info('Listening on %s' % (server.address,))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,181 @@
+"""
+Instrumentation of the conversion stages.
+
+Collection is off by default, and the instrumented code then only pays for
+a function call returning a do-nothing timer.  Once enabled, every stage
+records its wall time, number of calls, bytes written, and the number and
+duration of the subprocesses it ran (and, for the external tools, the time
+they waited to be run, see tools.py):
+
+collector = stats.enable()
+nbconvert.main('notebook.ipynb', 'latex')
+print(json.dumps(collector.report(), indent=1))
+
+The instrumented code does:
+
+with stats.timer('save') as t:
+    ...
+    t.bytes += len(data)
+
+or decorates whole functions with @stats.timed('read').
+
+Stages nest (pandoc runs inside markdown2latex, which runs while rendering
+markdown cells), so their times are not meant to be added up.
+"""
+
+import threading
+import time
+
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# The Stats collecting the measurements, None when collection is off
+current = None
+
+_fields = ('calls', 'time', 'bytes', 'subprocesses', 'subprocess_time',
+           'wait_time')
+
+
+class _Timer(object):
+    """Context manager adding its duration to a stage of a Stats."""
+
+    def __init__(self, collector, stage, subprocess):
+        self.collector = collector
+        self.stage = stage
+        self.subprocess = subprocess
+        self.bytes = 0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        stage = dict(calls=1, time=elapsed, bytes=self.bytes)
+        if self.subprocess:
+            stage.update(subprocesses=1, subprocess_time=elapsed)
+        self.collector.add(self.stage, **stage)
+        return False
+
+
+class _NullTimer(object):
+    """Timer used while collection is off, which records nothing."""
+
+    bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_timer = _NullTimer()
+
+
+class Stats(object):
+    """Measurements for each stage of the conversions.
+
+    Safe to use from several threads, as the SVG conversions are done.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.start = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, stage, **values):
+        """Add values (see _fields for the names) to the totals of stage."""
+        with self._lock:
+            totals = self.stages.get(stage)
+            if totals is None:
+                totals = self.stages[stage] = dict.fromkeys(_fields, 0)
+            for name, value in values.items():
+                totals[name] += value
+
+    def timer(self, stage, subprocess=False):
+        return _Timer(self, stage, subprocess)
+
+    def merge(self, report):
+        """Add the stages of a report from another Stats to this one."""
+        for stage, values in report['stages'].items():
+            self.add(stage, **values)
+
+    def report(self):
+        """Return the measurements as a dict, ready to be dumped as JSON."""
+        with self._lock:
+            stages = dict((stage, dict(values))
+                          for stage, values in self.stages.items())
+        report = dict(stages=stages, wall_time=time.time() - self.start)
+        if resource is not None:
+            # Kilobytes on Linux, bytes on OS X
+            report['max_rss'] = resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss
+        return report
+
+
+def enable():
+    """Start collecting measurements in a new Stats, which is returned."""
+    global current
+    current = Stats()
+    return current
+
+
+def disable():
+    """Stop collecting measurements."""
+    global current
+    current = None
+
+
+def add(stage, **values):
+    """Add values to the totals of stage, if collection is on."""
+    if current is not None:
+        current.add(stage, **values)
+
+
+def timer(stage, subprocess=False):
+    """Return a context manager timing one call of stage.
+
+    With subprocess=True, the call also counts as running a subprocess.  The
+    bytes attribute of the timer can be increased to record output."""
+    if current is None:
+        return _null_timer
+    return current.timer(stage, subprocess)
+
+
+class collect(object):
+    """Context manager collecting the measurements of its block in a new
+    Stats, without them going to the current one.
+
+    with stats.collect() as collector:
+        convert(...)
+    report = collector.report()
+    """
+
+    def __enter__(self):
+        global current
+        self.outer = current
+        current = Stats()
+        return current
+
+    def __exit__(self, *exc_info):
+        global current
+        current = self.outer
+        return False
+
+
+def timed(stage):
+    """Decorator timing every call of a function as one call of stage."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if current is None:
+                return func(*args, **kwargs)
+            with current.timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
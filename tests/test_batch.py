@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+
+import nose.tools as nt
+
+import batch
+
+
+def test_expand_paths():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for name in ['a.rst', 'b.txt', 'sub/c.rst', 'skip/d.rst']:
+            batch.makedirs(os.path.dirname(os.path.join(tmpdir, name)))
+            open(os.path.join(tmpdir, name), 'w').close()
+        a, c = os.path.join(tmpdir, 'a.rst'), os.path.join(tmpdir, 'sub/c.rst')
+        found = batch.expand_paths([tmpdir, os.path.join(tmpdir, '*.rst'),
+                                    'missing.rst'], ('.rst',), ('skip',))
+        nt.assert_equal(found, [(a, 'a.rst'), (c, 'sub/c.rst'),
+                                ('missing.rst', 'missing.rst')])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_check_outputs():
+    tasks = [('x/a.rst', 'out/a.ipynb'), ('y/a.rst', 'out/./a.ipynb'),
+             ('b.rst', 'out/b.ipynb')]
+    nt.assert_equal(batch.output_collisions(tasks),
+                    {'out/a.ipynb': ['x/a.rst', 'y/a.rst']})
+    nt.assert_raises(batch.OutputCollision, batch.check_outputs, tasks)
+    batch.check_outputs(tasks[1:])
+
+
+def convert_one(task):
+    result, error = batch.trap(lambda: 1 // task)
+    return task, error, 0.0, task != 1
+
+
+def test_run():
+    for jobs in (1, 2):
+        summary = batch.run(convert_one, [0, 1, 2], jobs, unchanged='cached')
+        nt.assert_equal(sorted(summary['succeeded']), [1, 2])
+        nt.assert_equal(summary['cached'], [1])
+        nt.assert_equal([task for task, error in summary['failed']], [0])
+        nt.assert_true('ZeroDivisionError' in summary['failed'][0][1])
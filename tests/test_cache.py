@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import nose.tools as nt
+
+from cache import ContentCache, atomic_write, content_key
+
+cache_dir = None
+k1, k2, k3 = [content_key(str(i)) for i in range(3)]
+
+
+def setup_dir():
+    global cache_dir
+    cache_dir = tempfile.mkdtemp()
+
+
+def remove_dir():
+    shutil.rmtree(cache_dir)
+
+
+def test_content_key():
+    nt.assert_equal(content_key('a', u'b'), content_key(u'a', 'b'))
+    nt.assert_not_equal(content_key('ab', 'c'), content_key('a', 'bc'))
+
+
+@nt.with_setup(setup_dir, remove_dir)
+def test_memory_and_disk_tiers():
+    cache = ContentCache(cache_dir, max_items=1)
+    cache.set(k1, 'v1')
+    cache.set(k2, 'v2')
+    nt.assert_equal(cache.get(k2), 'v2')
+    # k1 was pushed out of memory, but is still on disk
+    nt.assert_equal(cache.get(k1), 'v1')
+    nt.assert_equal(cache.get(k3), None)
+    nt.assert_equal(cache.stats(), dict(hits=2, memory_hits=1, disk_hits=1,
+                                        misses=1))
+    # A new cache on the same directory sees the entries
+    nt.assert_equal(ContentCache(cache_dir).get(k2), 'v2')
+
+
+@nt.with_setup(setup_dir, remove_dir)
+def test_eviction():
+    cache = ContentCache(cache_dir, max_bytes=1000)
+    for i in range(20):
+        cache.set(content_key(str(i)), 'x' * 100)
+    total = sum(os.path.getsize(os.path.join(dirpath, f))
+                for dirpath, dirnames, filenames in os.walk(cache_dir)
+                for f in filenames)
+    nt.assert_true(total <= 1000)
+    cache.clear()
+    nt.assert_equal(ContentCache(cache_dir).get(content_key('19')), None)
+
+
+@nt.with_setup(setup_dir, remove_dir)
+def test_atomic_write_errors():
+    fname = os.path.join(cache_dir, 'out')
+    nt.assert_equal(atomic_write(fname, lambda f: f.write('data') or 1), 1)
+    nt.assert_equal(open(fname).read(), 'data')
+    # A failed rename is an error, and leaves no temporary file behind
+    os.mkdir(os.path.join(cache_dir, 'dir'))
+    with nt.assert_raises(OSError):
+        atomic_write(os.path.join(cache_dir, 'dir'), 'data')
+    nt.assert_equal(sorted(os.listdir(cache_dir)), ['dir', 'out'])
@@ -0,0 +1,92 @@
+import os
+import random
+import shutil
+import tempfile
+
+import nose.tools as nt
+
+import dollarmath
+from dollarmath import replace_dollar, replace_dollar_lines
+
+
+def regex_replace_dollar(content):
+    """The regular expressions replace_dollar implements."""
+    content = dollarmath._dollar.sub(r":math:`\1`", content)
+    return dollarmath._notdollar.sub("$", content)
+
+
+def test_samples():
+    for expr, expect in dollarmath.samples.items():
+        nt.assert_equal(replace_dollar(expr), expect)
+
+
+def test_same_as_regex():
+    alphabet = u'$$$\\\\  ab.,;\n\t\r\xa0'
+    rng = random.Random(0)
+    for i in xrange(20000):
+        content = u''.join(rng.choice(alphabet)
+                           for j in range(rng.randint(0, 12)))
+        nt.assert_equal(replace_dollar(content), regex_replace_dollar(content))
+
+
+def test_lines():
+    lines = [u'no math', u'$a$ and \\$', u'', u'b$c$']
+    replace_dollar_lines(lines)
+    nt.assert_equal(lines, [u'no math', u':math:`a` and $', u'', u'b$c$'])
+
+
+class FakeApp(object):
+    """Enough of a Sphinx application for setup and the handlers."""
+
+    def __init__(self, doctreedir):
+        self.doctreedir = doctreedir
+        self.config = type('Config', (object,), {})()
+        self.handlers = {}
+        self._events = {'autodoc-process-docstring': ''}
+
+    def add_config_value(self, name, default, rebuild):
+        setattr(self.config, name, default)
+
+    def connect(self, event, handler):
+        self.handlers[event] = handler
+
+
+def test_setup():
+    app = FakeApp(None)
+    metadata = dollarmath.setup(app)
+    nt.assert_true(metadata['parallel_read_safe'])
+    nt.assert_true(metadata['parallel_write_safe'])
+    nt.assert_equal(sorted(app.handlers), ['autodoc-process-docstring',
+                                           'builder-inited', 'source-read'])
+
+
+def test_source_cache():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        app = FakeApp(tmpdir)
+        dollarmath.setup(app)
+        app.handlers['builder-inited'](app)
+        cache = dollarmath.source_cache
+        for i in range(2):
+            source = [u'Some $x\u00b2$ math\n']
+            app.handlers['source-read'](app, 'doc', source)
+            nt.assert_equal(source, [u'Some :math:`x\u00b2` math\n'])
+        nt.assert_equal((cache.hits, cache.misses), (1, 1))
+        # A new build finds the documents rewritten by the previous one
+        app.handlers['builder-inited'](app)
+        source = [u'Some $x\u00b2$ math\n']
+        app.handlers['source-read'](app, 'doc', source)
+        nt.assert_equal(source, [u'Some :math:`x\u00b2` math\n'])
+        nt.assert_equal(dollarmath.source_cache.disk_hits, 1)
+    finally:
+        dollarmath.source_cache = None
+        shutil.rmtree(tmpdir)
+
+
+def test_own_cache_module():
+    """The cache comes from the file next to the extension, whatever else is
+    called cache on the path"""
+    here = os.path.dirname(os.path.realpath(dollarmath.__file__))
+    nt.assert_equal(dollarmath._cache.__name__, 'dollarmath_cache')
+    nt.assert_equal(os.path.splitext(os.path.realpath(
+        dollarmath._cache.__file__))[0], os.path.join(here, 'cache'))
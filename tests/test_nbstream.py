@@ -0,0 +1,35 @@
+import nose.tools as nt
+from StringIO import StringIO
+
+import nbstream
+from IPython.nbformat import current as nbformat
+
+fname = 'tests/test.ipynb'
+
+
+def read_all(f):
+    """Read a notebook with nbstream, turning its iterators into lists"""
+    nb = nbstream.read(f)
+    worksheets = []
+    for ws in nb.worksheets:
+        ws.cells = list(ws.cells)
+        worksheets.append(ws)
+    nb.worksheets = worksheets
+    return nb
+
+
+def test_read():
+    """Streaming gives the same notebook as nbformat.read"""
+    with open(fname) as f:
+        expected = nbformat.read(f, 'json')
+    for chunk_size in (5, 2**16):
+        nbstream._Scanner.chunk_size = chunk_size
+        with open(fname) as f:
+            nt.assert_equal(read_all(f), expected)
+    nbstream._Scanner.chunk_size = 2**16
+
+
+def test_read_truncated():
+    with open(fname) as f:
+        data = f.read()
+    nt.assert_raises(ValueError, read_all, StringIO(data[:len(data) // 2]))
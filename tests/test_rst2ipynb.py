@@ -1,8 +1,11 @@
 import os
 import errno
 import os.path
+import shutil
 import subprocess
+import tempfile
 import nose.tools as nt
+from StringIO import StringIO
 
 test_rst_fname = os.path.join('tests', 'tutorial.rst.ref')
 ref_ipynb_fname = os.path.join('tests', 'tutorial.ipynb.ref')
@@ -26,3 +29,77 @@ def test_command_line():
                             stdout=subprocess.PIPE)
     output = proc.communicate()[0]
     nt.assert_equal(ref_output, output)
+
+
+def test_batch():
+    from rst2ipynb import convert_many
+    proc = subprocess.Popen(['./rst2ipynb.py', test_rst_fname],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ref_output = proc.communicate()[0]
+    outdir = tempfile.mkdtemp()
+    try:
+        for jobs in (1, 2):
+            summary = convert_many([test_rst_fname, test_rst_fname + '.none'],
+                                   outdir, jobs=jobs)
+            nt.assert_equal(summary['succeeded'], [test_rst_fname])
+            nt.assert_equal(len(summary['failed']), 1)
+            with open(os.path.join(outdir, 'tutorial.rst.ipynb'), 'rb') as f:
+                nt.assert_equal(f.read(), ref_output)
+    finally:
+        shutil.rmtree(outdir)
+
+
+def test_batch_refuses_collisions():
+    from rst2ipynb import convert_many
+    tmpdir = tempfile.mkdtemp()
+    try:
+        infiles = []
+        for sub in ('x', 'y'):
+            os.mkdir(os.path.join(tmpdir, sub))
+            infiles.append(os.path.join(tmpdir, sub, 'index.rst'))
+            shutil.copy(test_rst_fname, infiles[-1])
+        outdir = os.path.join(tmpdir, 'out')
+        nt.assert_raises(SystemExit, convert_many, infiles, outdir)
+        nt.assert_false(os.path.exists(outdir))
+        # Found in a directory, they keep their place
+        summary = convert_many([tmpdir], outdir)
+        nt.assert_equal(len(summary['succeeded']), 2)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_stream():
+    import docutils.core
+    import rst2ipynblib
+    for source in ['', 'Title\n=====\n\nA *paragraph*.\n']:
+        output = docutils.core.publish_string(
+            source, writer=rst2ipynblib.Writer())
+        writer = rst2ipynblib.Writer()
+        writer.stream = StringIO()
+        nt.assert_equal(docutils.core.publish_string(source, writer=writer),
+                        '')
+        nt.assert_equal(writer.stream.getvalue(), output)
+
+
+def test_batch_cache():
+    from rst2ipynb import convert_many
+    tmpdir = tempfile.mkdtemp()
+    try:
+        doc = os.path.join(tmpdir, 'doc.rst')
+        part = os.path.join(tmpdir, 'part.txt')
+        with open(doc, 'w') as f:
+            f.write('Title\n=====\n\n.. include:: part.txt\n')
+        cache_dir = os.path.join(tmpdir, 'cache')
+        outputs = []
+        for text in ['First.', 'First.', 'Second.']:
+            with open(part, 'w') as f:
+                f.write(text + '\n')
+            summary = convert_many([doc], cache_dir=cache_dir)
+            with open(os.path.join(tmpdir, 'doc.ipynb')) as f:
+                outputs.append(f.read())
+            nt.assert_true(text in outputs[-1])
+            outputs[-1] = (outputs[-1], summary['cached'])
+        nt.assert_equal(outputs[1], (outputs[0][0], [doc]))
+        nt.assert_equal(outputs[2][1], [])
+    finally:
+        shutil.rmtree(tmpdir)
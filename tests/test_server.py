@@ -0,0 +1,108 @@
+import httplib
+import json
+import multiprocessing
+import threading
+import time
+import urllib2
+import nose.tools as nt
+
+from server import ConversionServer, WorkerPool
+
+server = None
+
+
+def start_server():
+    global server
+    server = ConversionServer(port=0, workers=1, timeout=30)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+
+def stop_server():
+    server.shutdown()
+
+
+def request(path, data=None):
+    url = 'http://%s:%i%s' % (server.address + (path,))
+    try:
+        response = urllib2.urlopen(url, data)
+    except urllib2.HTTPError as e:
+        response = e
+    return response.getcode(), json.loads(response.read())
+
+
+@nt.with_setup(start_server, stop_server)
+def test_convert():
+    with open('tests/test.ipynb') as f:
+        nb_json = f.read()
+    status, result = request('/convert?format=rst&name=nb', nb_json)
+    nt.assert_equal(status, 200)
+    nt.assert_true(result['figures'])
+    for fname in result['figures']:
+        nt.assert_true(fname.startswith('nb_files/'))
+        nt.assert_true(fname in result['output'])
+
+    status, result = request('/convert?format=rst', '{"not": "a notebook"}')
+    nt.assert_equal(status, 422)
+    status, result = request('/convert?format=nope', nb_json)
+    nt.assert_equal(status, 400)
+
+    nt.assert_equal(request('/health'), (200, dict(status='ok', workers=1)))
+    status, metrics = request('/metrics')
+    nt.assert_equal(metrics['requests'], {'200': 1, '400': 1, '422': 1})
+    nt.assert_equal(metrics['in_progress'], 0)
+
+
+@nt.with_setup(start_server, stop_server)
+def test_bad_requests():
+    status, result = request('/convert?figure_naming=bogus', '{}')
+    nt.assert_equal(status, 400)
+    nt.assert_true('figure_naming' in result['error'])
+    conn = httplib.HTTPConnection(*server.address)
+    conn.putrequest('POST', '/convert')
+    conn.putheader('Content-Length', '-1')
+    conn.endheaders()
+    nt.assert_equal(conn.getresponse().status, 400)
+    conn.close()
+
+
+@nt.with_setup(start_server, stop_server)
+def test_health_saturated():
+    for i in range(server.max_requests):
+        server.slots.acquire()
+    try:
+        status, result = request('/health')
+        nt.assert_equal(status, 503)
+        nt.assert_equal(result['status'], 'unavailable')
+    finally:
+        for i in range(server.max_requests):
+            server.slots.release()
+    nt.assert_equal(request('/health')[0], 200)
+
+
+def test_timeout_excludes_queue():
+    """Only the conversion itself counts towards the timeout, not the wait
+    for a free worker"""
+    pool = WorkerPool(1, timeout=1.0)
+    try:
+        results = []
+
+        def run():
+            try:
+                results.append(pool.run(time.sleep, (0.6,)))
+            except multiprocessing.TimeoutError:
+                results.append('timeout')
+        threads = [threading.Thread(target=run) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        nt.assert_equal(results, [None] * 3)
+        nt.assert_equal(pool.restarts, 0)
+        # A conversion running too long still times out
+        nt.assert_raises(multiprocessing.TimeoutError, pool.run, time.sleep,
+                         (1.5,))
+        nt.assert_equal(pool.restarts, 1)
+    finally:
+        pool.close()
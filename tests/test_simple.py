@@ -1,8 +1,20 @@
-from nbconvert import ConverterRST, main
+import nbconvert
+from nbconvert import (Converter, ConverterRST, main, build, expand_infiles,
+                       convert_many, convert_notebook, markdown2latex,
+                       markdown2latex_many, iter_base64_decode)
 import nose.tools as nt
+from nose.plugins.skip import SkipTest
 
 import os
+import base64
+import copy
+import binascii
 import glob
+import random
+import shutil
+import subprocess
+import tempfile
+from StringIO import StringIO
 from IPython.nbformat import current as nbformat
 
 fname = 'tests/test.ipynb'
@@ -14,6 +26,7 @@ def clean_dir():
     map(os.remove, glob.glob("./tests/*.rst"))
     map(os.remove, glob.glob("./tests/*.png"))
     map(os.remove, glob.glob("./tests/*.html"))
+    shutil.rmtree('tests/test_files', ignore_errors=True)
 
 
 @nt.with_setup(clean_dir, clean_dir)
@@ -67,3 +80,353 @@ def test_main_html():
     """
     main(fname, format='html')
     nt.assert_true(os.path.exists('tests/test.html'))
+
+
+def test_doc_inherit():
+    """Docstrings are inherited once, by plain methods"""
+    nt.assert_equal(ConverterRST.render_code.__doc__,
+                    Converter.render_code.__doc__)
+    nt.assert_true(callable(ConverterRST.__dict__['render_code']))
+    c = ConverterRST('')
+    nt.assert_equal(c.dispatch('code'), c.render_code)
+    nt.assert_equal(c.dispatch('nonexistent'), c.render_unknown)
+
+
+def test_expand_infiles():
+    """Directories and globs expand to notebooks, without duplicates"""
+    infiles = expand_infiles(['tests', 'tests/*.ipynb', fname])
+    nt.assert_equal(infiles, [fname])
+
+
+def test_convert_many_refuses_collisions():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        infiles = []
+        for sub in ('x', 'y'):
+            os.mkdir(os.path.join(tmpdir, sub))
+            infiles.append(os.path.join(tmpdir, sub, 'index.ipynb'))
+            shutil.copy(fname, infiles[-1])
+        nt.assert_equal(nbconvert.output_collisions(infiles, 'rst'),
+                        {'index.rst': infiles})
+        nt.assert_raises(SystemExit, convert_many, infiles, format='rst')
+        nt.assert_false(os.path.exists('index.rst'))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_convert_many_isolates_failures():
+    """A notebook that fails to convert is reported, not raised"""
+    summary = convert_many(['missing_dir/missing.ipynb'], format='rst')
+    nt.assert_equal(summary['succeeded'], [])
+    nt.assert_equal(len(summary['failed']), 1)
+    nt.assert_equal(summary['failed'][0][0], 'missing_dir/missing.ipynb')
+
+
+def have_pandoc():
+    try:
+        subprocess.call(['pandoc', '--version'], stdout=subprocess.PIPE)
+    except OSError:
+        return False
+    return True
+
+
+def test_markdown2latex_many():
+    """Batched pandoc conversion matches converting each cell on its own"""
+    if not have_pandoc():
+        raise SkipTest('pandoc is not installed')
+    sources = [u'some *text*', u'# A heading', u'- a\n- b', u'',
+               u'```\nunclosed fence', u'see [A heading]', u'some *text*',
+               u'(@) first', u'(@) second', u'\\newcommand{\\R}{x}',
+               u'$\\R$', u'a note^[inline]', u'another^[inline]']
+    nt.assert_equal(markdown2latex_many(sources),
+                    [markdown2latex(src) for src in sources])
+
+
+def test_pandoc_global_constructs():
+    """Cells depending on the rest of the pandoc document aren't batched"""
+    for src in [u'# A heading', u'Title\n=====', u'% title',
+                u'[A]: http://a', u'[^1]: a note', u'a note[^1]',
+                u'a note^[inline]', u'(@) an example', u'see (@good)',
+                u'\\newcommand{\\R}{x}', u'$\\renewcommand\\R{y}$',
+                u'\\def\\R{x}', u'\\let\\R\\x', u'\\newenvironment{e}{}{}']:
+        nt.assert_true(nbconvert._pandoc_global_re.search(src), src)
+    for src in [u'some *text*', u'$x^2 + [a]$', u'$\\R \\default$',
+                u'a (@ b)', u'- a\n- b', u'[a link](http://a)']:
+        nt.assert_false(nbconvert._pandoc_global_re.search(src), src)
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_figure_naming_hash():
+    """Identical figures named by content hash share a single file"""
+    c = ConverterRST(fname)
+    c.figure_naming = 'hash'
+    svg = u'<svg></svg>'
+    f1 = c._new_figure(svg, 'svg')
+    f2 = c._new_figure(svg, 'svg')
+    nt.assert_equal(f1, f2)
+    nt.assert_equal(os.listdir('tests/test_files'), [os.path.basename(f1)])
+    nt.assert_not_equal(c._new_figure(u'<svg>2</svg>', 'svg'), f1)
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_svg2pdf_once_per_file():
+    """Identical SVG figures named by hash are converted to PDF once"""
+    calls = []
+    svg2pdf = nbconvert.svg2pdf
+    nbconvert.svg2pdf = lambda svg_file, pdf_file: calls.append(pdf_file)
+    try:
+        for svg_workers in (1, 4):
+            del calls[:]
+            c = nbconvert.ConverterLaTeX(fname)
+            c.figure_naming = 'hash'
+            c.svg_workers = svg_workers
+            for i in range(3):
+                svg_file = c._new_figure(u'<svg></svg>', 'svg')
+                c._svg_lines(svg_file)
+            c.wait_for_svg2pdf()
+            pdf_file = os.path.splitext(svg_file)[0] + '.pdf'
+            nt.assert_equal(calls, [pdf_file])
+            nt.assert_equal(c.figures, [svg_file, pdf_file])
+    finally:
+        nbconvert.svg2pdf = svg2pdf
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_figure_write_interrupted():
+    """A figure whose write fails is not left truncated, to be taken as
+    already written by the next conversion"""
+    c = ConverterRST(fname)
+    c.figure_naming = 'hash'
+
+    def write_part(f, data, fmt):
+        f.write('<svg')
+        raise KeyboardInterrupt
+    c._write_figure = write_part
+    nt.assert_raises(KeyboardInterrupt, c._new_figure, u'<svg></svg>', 'svg')
+    nt.assert_equal(os.listdir('tests/test_files'), [])
+    c = ConverterRST(fname)
+    c.figure_naming = 'hash'
+    with open(c._new_figure(u'<svg></svg>', 'svg')) as f:
+        nt.assert_equal(f.read(), '<svg></svg>')
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_write_blocks():
+    """Streaming the output gives the same bytes as convert()"""
+    c = ConverterRST(fname)
+    c.read()
+    expected = c.convert().encode('utf-8')
+    c = ConverterRST(fname)
+    c.read()
+    f = StringIO()
+    c.write_blocks(f)
+    nt.assert_equal(f.getvalue(), expected)
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_stream_input_closed():
+    """The notebook file streamed cells are read from is closed once they
+    are converted"""
+    c = ConverterRST(fname)
+    c.stream_input = True
+    c.read()
+    f = c.input_file
+    nt.assert_false(f.closed)
+    c.convert()
+    nt.assert_true(f.closed)
+    nt.assert_equal(c.input_file, None)
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_convert_notebook():
+    """In-memory conversion gives the same document and figures as main(),
+    without writing anything"""
+    with open(fname) as f:
+        nb_json = f.read()
+    output, figures = convert_notebook(nb_json, 'rst', 'tests/test')
+    nt.assert_false(os.path.exists('tests/test_files'))
+    nt.assert_true(figures)
+    with open(main(fname, 'rst')) as f:
+        nt.assert_equal(f.read().decode('utf-8'), output)
+    for name, data in figures.items():
+        with open(name, 'rb') as f:
+            nt.assert_equal(f.read(), data)
+
+
+def test_cell_workers():
+    """Rendering cells in parallel gives the same document and figures"""
+    with open(fname) as f:
+        nb = nbformat.read(f, 'json')
+    formats = ['rst', 'quick-html']
+    # Markdown cells go through pandoc for latex
+    if have_pandoc():
+        formats.append('latex')
+    for format in formats:
+        serial = convert_notebook(nb, format, 'tests/test')
+        parallel = convert_notebook(nb, format, 'tests/test', cell_workers=3)
+        nt.assert_equal(parallel, serial)
+
+
+def test_convert_notebook_leaves_input():
+    """Converting a NotebookNode doesn't change it"""
+    with open(fname) as f:
+        nb = nbformat.read(f, 'json')
+    cell = nbformat.new_text_cell('markdown', u'![a figure](/files/a.png)')
+    nb.worksheets[0].cells.append(cell)
+    expected = copy.deepcopy(nb)
+    for format in ['rst', 'quick-html']:
+        convert_notebook(nb, format, 'tests/test')
+        nt.assert_equal(nb, expected)
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_build_incremental():
+    """Unchanged notebooks are skipped, and stale figures removed"""
+    nt.assert_true(build(fname)[1])
+    counter_figures = glob.glob('tests/test_files/*.png')
+    nt.assert_not_equal(counter_figures, [])
+    nt.assert_false(build(fname)[1])
+    # Other options mean another conversion, with other figure names
+    nt.assert_true(build(fname, figure_naming='hash')[1])
+    hash_figures = glob.glob('tests/test_files/*.png')
+    nt.assert_not_equal(hash_figures, [])
+    nt.assert_equal(set(hash_figures) & set(counter_figures), set())
+    outfile, converted = build(fname, figure_naming='hash')
+    nt.assert_false(converted)
+    # Options which don't change the output don't make it stale
+    nt.assert_false(build(fname, figure_naming='hash', cell_workers=2,
+                          stream_input=True, stream_output=True)[1])
+    # An output overwritten by something else is converted again
+    with open(outfile, 'w') as f:
+        f.write('another notebook')
+    nt.assert_true(build(fname, figure_naming='hash')[1])
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_fragment_cache():
+    """Cells from the fragment cache give the same output and figures"""
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = nbconvert.enable_fragment_cache(cache_dir)
+        outputs = []
+        for i in range(2):
+            c = ConverterRST(fname)
+            c.read()
+            outputs.append((c.convert(), c.figures_counter, c.figures))
+        nt.assert_equal(outputs[0], outputs[1])
+        nt.assert_equal(cache.misses, cache.hits)
+        # Figures which changed on disk are not referred to blindly
+        with open(outputs[0][2][0], 'wb') as f:
+            f.write('changed')
+        c = ConverterRST(fname)
+        c.read()
+        nt.assert_equal(c.convert(), outputs[0][0])
+        nt.assert_not_equal(open(outputs[0][2][0], 'rb').read(), 'changed')
+    finally:
+        nbconvert.fragment_cache = None
+        shutil.rmtree(cache_dir)
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_fragment_cache_latex():
+    """Markdown cells are looked up in the fragment cache once"""
+    if not have_pandoc():
+        raise SkipTest('pandoc is not installed')
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = nbconvert.enable_fragment_cache(cache_dir)
+        outputs = []
+        for i in range(2):
+            c = nbconvert.ConverterLaTeX(fname)
+            c.read()
+            outputs.append(c.convert())
+        nt.assert_equal(outputs[0], outputs[1])
+        ncells = sum(len(ws.cells) for ws in c.nb.worksheets)
+        nt.assert_equal((cache.misses, cache.hits), (ncells, ncells))
+    finally:
+        nbconvert.fragment_cache = None
+        shutil.rmtree(cache_dir)
+
+
+def test_fragment_key_inkscape():
+    """Cells with SVG figures aren't reused across inkscape versions"""
+    c = nbconvert.ConverterLaTeX(fname)
+    svg = nbformat.new_output('display_data', output_svg=u'<svg></svg>')
+    cells = [nbformat.new_code_cell(u'plot()', outputs=[svg]),
+             nbformat.new_code_cell(u'x = 1')]
+    version = nbconvert._inkscape_version
+    try:
+        keys = []
+        for nbconvert._inkscape_version in ('0.48', '0.92'):
+            keys.append([c.fragment_key(cell) for cell in cells])
+    finally:
+        nbconvert._inkscape_version = version
+    nt.assert_not_equal(keys[0][0], keys[1][0])
+    nt.assert_equal(keys[0][1], keys[1][1])
+
+
+def test_svg_cache_without_inkscape():
+    """PDFs in the SVG cache are used when inkscape isn't installed"""
+    inkscape, version = nbconvert.inkscape, nbconvert._inkscape_version
+    svg_cache = nbconvert.svg_cache
+    tmpdir = tempfile.mkdtemp()
+    try:
+        nbconvert.inkscape = os.path.join(tmpdir, 'inkscape')
+        nbconvert._inkscape_version = None
+        cache = nbconvert.enable_svg_cache(None)
+        cache.set(nbconvert._svg_version_key, 'Inkscape 0.48')
+        cache.set(nbconvert.content_key('Inkscape 0.48', '<svg/>'), '%PDF')
+        nt.assert_equal(nbconvert.svg2pdf_data('<svg/>'), '%PDF')
+        svg_file = os.path.join(tmpdir, 'fig.svg')
+        pdf_file = os.path.join(tmpdir, 'fig.pdf')
+        with open(svg_file, 'wb') as f:
+            f.write('<svg/>')
+        nbconvert.svg2pdf(svg_file, pdf_file)
+        nt.assert_equal(open(pdf_file, 'rb').read(), '%PDF')
+        nt.assert_raises(OSError, nbconvert.svg2pdf_data, '<svg>2</svg>')
+    finally:
+        nbconvert.inkscape, nbconvert._inkscape_version = inkscape, version
+        nbconvert.svg_cache = svg_cache
+        shutil.rmtree(tmpdir)
+
+
+def test_rst2html_cmd_includes():
+    """rst2html resolves included files relative to the source"""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmpdir, 'part.rst'), 'w') as f:
+            f.write('Included text\n')
+        source = '.. include:: part.rst\n'
+        try:
+            html = nbconvert._rst2html_cmd(
+                source, os.path.join(tmpdir, 'doc.rst'))
+        except OSError:
+            raise SkipTest('rst2html is not installed')
+        nt.assert_true('Included text' in html)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_iter_base64_decode():
+    """Decoding by blocks gives the same bytes as decoding all at once"""
+    data = base64.encodestring(''.join(map(chr, range(256))) * 10)
+    for block_size in (1, 5, 77, 2**16):
+        nt.assert_equal(''.join(iter_base64_decode(data, block_size)),
+                        data.decode('base64'))
+
+
+def test_iter_base64_decode_malformed():
+    """Stray padding and truncated data are dealt with as by str.decode"""
+    def decode(func):
+        try:
+            return func()
+        except binascii.Error as e:
+            return 'error: %s' % e
+    rng = random.Random(0)
+    for i in range(2000):
+        data = ''.join(rng.choice('QUJD==/+* \n') for j in range(12))
+        expected = decode(lambda: data.decode('base64'))
+        for block_size in (1, 2, 3, 5, 64):
+            nt.assert_equal(decode(lambda: ''.join(
+                iter_base64_decode(data, block_size))), expected)
+    nt.assert_equal(''.join(iter_base64_decode('1C=A* /')), '\xd4 ?')
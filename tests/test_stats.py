@@ -0,0 +1,51 @@
+import os
+import glob
+import shutil
+import nose.tools as nt
+
+import stats
+from nbconvert import ConverterRST
+
+
+def clean_dir():
+    map(os.remove, glob.glob('tests/*.rst'))
+    if os.path.exists('test.rst'):
+        os.remove('test.rst')
+    shutil.rmtree('tests/test_files', ignore_errors=True)
+
+
+def test_disabled():
+    stats.disable()
+    with stats.timer('stage') as t:
+        t.bytes += 10
+    stats.add('stage', bytes=1)
+    nt.assert_equal(stats.current, None)
+
+
+def test_timer_and_merge():
+    collector = stats.Stats()
+    with collector.timer('pandoc', subprocess=True) as t:
+        t.bytes += 10
+    with collector.timer('pandoc', subprocess=True):
+        pass
+    report = collector.report()
+    nt.assert_equal(report['stages']['pandoc']['calls'], 2)
+    nt.assert_equal(report['stages']['pandoc']['subprocesses'], 2)
+    nt.assert_equal(report['stages']['pandoc']['bytes'], 10)
+    other = stats.Stats()
+    other.merge(report)
+    other.merge(report)
+    nt.assert_equal(other.report()['stages']['pandoc']['calls'], 4)
+
+
+@nt.with_setup(clean_dir, clean_dir)
+def test_conversion_stages():
+    with stats.collect() as collector:
+        c = ConverterRST('tests/test.ipynb')
+        c.render()
+    nt.assert_equal(stats.current, None)
+    stages = collector.report()['stages']
+    nt.assert_equal(stages['read']['calls'], 1)
+    nt.assert_true(stages['save']['bytes'] > 0)
+    nt.assert_true(stages['figure']['bytes'] > 0)
+    nt.assert_true(stages['cell.code']['calls'] > 0)
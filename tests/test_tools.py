@@ -0,0 +1,92 @@
+import logging
+import sys
+import threading
+import time
+
+import nose.tools as nt
+
+import stats
+import tools
+from tools import Tool, ToolError, ToolTimeout
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_run():
+    tool = Tool('cat')
+    out, err = tool.run(['cat'], 'some input')
+    nt.assert_equal((out, err), ('some input', ''))
+    nt.assert_equal(tool.metrics()['calls'], 1)
+
+
+def test_error_and_stderr():
+    handler = ListHandler()
+    tools.logger.addHandler(handler)
+    try:
+        tool = Tool('failing')
+        cmd = python('import sys; sys.stderr.write("oops"); sys.exit(3)')
+        with nt.assert_raises(ToolError) as cm:
+            tool.run(cmd)
+        nt.assert_equal(cm.exception.returncode, 3)
+        nt.assert_equal(cm.exception.stderr, 'oops')
+        nt.assert_equal(tool.run(cmd, check=False), ('', 'oops'))
+        nt.assert_equal(handler.messages, ['failing: oops'] * 2)
+        nt.assert_equal(tool.metrics()['failures'], 2)
+    finally:
+        tools.logger.removeHandler(handler)
+
+
+def test_timeout_and_retries():
+    tool = Tool('sleep', timeout=0.2, retries=1)
+    start = time.time()
+    with nt.assert_raises(ToolTimeout):
+        tool.run(['sleep', '10'])
+    nt.assert_true(time.time() - start < 2)
+    metrics = tool.metrics()
+    nt.assert_equal((metrics['calls'], metrics['timeouts'],
+                     metrics['retried'], metrics['failures']), (2, 2, 1, 1))
+    # A call given more time succeeds
+    tool.run(['sleep', '0.1'], timeout=5)
+
+
+def test_max_running():
+    tool = Tool('sleep', max_running=2)
+    collector = stats.enable()
+    try:
+        threads = [threading.Thread(target=tool.run, args=(['sleep', '0.3'],))
+                   for i in range(4)]
+        start = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Two rounds of two calls
+        nt.assert_true(time.time() - start >= 0.6)
+        metrics = tool.metrics()
+        nt.assert_equal(metrics['calls'], 4)
+        nt.assert_true(metrics['wait_time'] >= 0.5)
+        stage = collector.report()['stages']['sleep']
+        nt.assert_equal(stage['subprocesses'], 4)
+        nt.assert_almost_equal(stage['wait_time'], metrics['wait_time'])
+    finally:
+        stats.disable()
+
+
+def test_configure():
+    tool = tools.configure('some-tool', max_running=3, timeout=None,
+                           retries=0)
+    nt.assert_true(tools.get_tool('some-tool') is tool)
+    nt.assert_equal((tool.max_running, tool.timeout, tool.retries),
+                    (3, None, 0))
+    nt.assert_true('some-tool' in tools.metrics())
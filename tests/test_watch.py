@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import nose.tools as nt
+
+from watch import Watcher
+
+tmpdir = None
+
+
+def setup_dir():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+
+def remove_dir():
+    shutil.rmtree(tmpdir)
+
+
+@nt.with_setup(setup_dir, remove_dir)
+def test_polling():
+    """Modified and new files are reported, once per burst of changes"""
+    old = os.path.join(tmpdir, 'old.ipynb')
+    new = os.path.join(tmpdir, 'new.ipynb')
+    open(old, 'w').close()
+    files = lambda: [f for f in (old, new) if os.path.exists(f)]
+    watcher = Watcher(files, [tmpdir], debounce=0.01, interval=0.01,
+                      use_inotify=False)
+    changes = watcher.changes()
+    with open(old, 'w') as f:
+        f.write('changed')
+    open(new, 'w').close()
+    nt.assert_equal(next(changes), sorted([old, new]))
+    # Only the modification time changed
+    os.utime(new, (0, 0))
+    nt.assert_equal(next(changes), [new])
+    watcher.close()
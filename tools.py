@@ -0,0 +1,232 @@
+"""
+Running the external tools (pandoc, inkscape, rst2html) the conversions need.
+
+Every call goes through the Tool of its program, which
+
+- limits the number of copies of the program running at once, across all
+  the threads of the process (the SVG conversions and the cell workers);
+- kills the program if it runs for longer than its timeout, and raises
+  ToolTimeout, so that a hung program can't stall a conversion forever;
+- retries the calls which timed out or were killed by a signal;
+- sends what the program prints on stderr to the 'nbconvert.tools' logger;
+- counts the time spent waiting for a free slot apart from the time spent
+  running, both in its own counters and in the current stats.
+
+Usage:
+
+out, err = tools.run('pandoc', ['pandoc', '-t', 'latex'], input=src)
+
+tools.configure('inkscape', max_running=2, timeout=60, retries=1)
+"""
+
+import logging
+import subprocess
+import threading
+import time
+
+import stats
+
+logger = logging.getLogger('nbconvert.tools')
+
+# Settings of the tools made by get_tool, see Tool.  None for max_running
+# means one per CPU, but at least as many as the SVG conversions running at
+# once by default (ConverterLaTeX.svg_workers).
+default_max_running = None
+default_timeout = 300
+default_retries = 1
+
+# The Tool of each program, see get_tool
+_tools = {}
+_tools_lock = threading.Lock()
+
+
+class ToolError(subprocess.CalledProcessError):
+    """A tool exited with an error.  stderr holds what it printed there."""
+
+    def __init__(self, returncode, cmd, output=None, stderr=None):
+        subprocess.CalledProcessError.__init__(self, returncode, cmd, output)
+        self.stderr = stderr
+
+    def __str__(self):
+        msg = subprocess.CalledProcessError.__str__(self)
+        if self.stderr:
+            msg += ':\n' + self.stderr.strip()
+        return msg
+
+
+class ToolTimeout(ToolError):
+    """A tool was killed for running longer than its timeout."""
+
+    def __init__(self, cmd, timeout):
+        ToolError.__init__(self, None, cmd)
+        self.timeout = timeout
+
+    def __str__(self):
+        return "Command '%s' timed out after %s seconds" % (self.cmd,
+                                                            self.timeout)
+
+
+class Tool(object):
+    """The calls to an external program.  Safe to use from several threads.
+
+    Parameters
+    ----------
+    name : string
+      Name of the program, for the logs.
+    max_running : int
+      Number of calls which can run at the same time, the others wait for
+      one of them to finish.  Defaults to the number of CPUs, or 4.
+    timeout : float
+      Seconds after which a call is killed, None for no limit.
+    retries : int
+      Number of times a call which timed out, or was killed by a signal, is
+      tried again.
+
+    The calls are counted in the stage of the stats named after the tool.
+    """
+
+    def __init__(self, name, max_running=None, timeout=None, retries=0):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        if max_running is None:
+            import multiprocessing
+            max_running = max(multiprocessing.cpu_count(), 4)
+        self.set_max_running(max_running)
+        self._lock = threading.Lock()
+        self.calls = self.failures = self.timeouts = self.retried = 0
+        self.wait_time = self.run_time = 0.0
+
+    def set_max_running(self, max_running):
+        # Calls already waiting on the previous semaphore keep to its limit
+        self.max_running = max_running
+        self._slots = threading.BoundedSemaphore(max_running)
+
+    def metrics(self):
+        """Return the counters of the calls so far, as a dict."""
+        with self._lock:
+            return dict(calls=self.calls, failures=self.failures,
+                        timeouts=self.timeouts, retried=self.retried,
+                        wait_time=self.wait_time, run_time=self.run_time)
+
+    def run(self, cmd, input=None, check=True, timeout=None, **kwargs):
+        """Run cmd with input on its stdin, and return its (stdout, stderr).
+
+        Raises ToolError if the program exits with an error and check is
+        true, or ToolTimeout if it runs for longer than timeout (which
+        defaults to that of the tool) on every try.  Other keyword arguments
+        are passed to subprocess.Popen.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        for attempt in range(self.retries + 1):
+            if attempt:
+                logger.warning('%s: trying again (%i of %i)' % (
+                    self.name, attempt, self.retries))
+                self._count(retried=1)
+            try:
+                out, err, returncode = self._run_once(cmd, input, timeout,
+                                                      kwargs)
+            except ToolTimeout:
+                self._count(timeouts=1)
+                logger.error('%s: killed after %s seconds' % (self.name,
+                                                             timeout))
+                if attempt == self.retries:
+                    self._count(failures=1)
+                    raise
+                continue
+            if returncode < 0 and attempt < self.retries:
+                logger.error('%s: killed by signal %i' % (self.name,
+                                                         -returncode))
+                continue
+            break
+        if err:
+            logger.warning('%s: %s' % (self.name, err.strip()))
+        if returncode:
+            self._count(failures=1)
+            if check:
+                raise ToolError(returncode, cmd, out, err)
+        return out, err
+
+    def _run_once(self, cmd, input, timeout, kwargs):
+        start = time.time()
+        with self._slots:
+            started = time.time()
+            try:
+                proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, **kwargs)
+                timed_out = []
+                if timeout is not None:
+                    timer = threading.Timer(timeout, self._kill,
+                                            (proc, timed_out))
+                    timer.daemon = True
+                    timer.start()
+                try:
+                    out, err = proc.communicate(input)
+                finally:
+                    if timeout is not None:
+                        timer.cancel()
+                        timer.join()
+            finally:
+                done = time.time()
+                self._count(calls=1, wait_time=started - start,
+                            run_time=done - started)
+                stats.add(self.name, calls=1, time=done - start,
+                          subprocesses=1, subprocess_time=done - started,
+                          wait_time=started - start)
+        if timed_out:
+            raise ToolTimeout(cmd, timeout)
+        return out, err, proc.returncode
+
+    @staticmethod
+    def _kill(proc, timed_out):
+        timed_out.append(True)
+        try:
+            proc.kill()
+        except OSError:
+            # It has just exited
+            pass
+
+    def _count(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+def get_tool(name):
+    """Return the Tool of the program name, made with the default settings
+    the first time."""
+    with _tools_lock:
+        tool = _tools.get(name)
+        if tool is None:
+            tool = _tools[name] = Tool(name, default_max_running,
+                                       default_timeout, default_retries)
+        return tool
+
+
+def configure(name, max_running=None, timeout=False, retries=None):
+    """Change the settings of the Tool of the program name, see Tool.
+
+    Only the settings given are changed; timeout=None removes the time
+    limit.  Returns the tool."""
+    tool = get_tool(name)
+    if max_running is not None:
+        tool.set_max_running(max_running)
+    if timeout is not False:
+        tool.timeout = timeout
+    if retries is not None:
+        tool.retries = retries
+    return tool
+
+
+def run(name, cmd, input=None, **kwargs):
+    """Run cmd with the Tool of the program name, see Tool.run."""
+    return get_tool(name).run(cmd, input, **kwargs)
+
+
+def metrics():
+    """Return the metrics of every tool used so far, by name."""
+    with _tools_lock:
+        tools = dict(_tools)
+    return dict((name, tool.metrics()) for name, tool in tools.items())
@@ -0,0 +1,143 @@
+"""
+Watch files for modifications, for converting notebooks as they are saved.
+
+Usage:
+
+watcher = Watcher(lambda: ['a.ipynb', 'b.ipynb'], ['.'])
+for changed in watcher.changes():
+    print(changed)
+
+The watched files are given by a function, called again to notice new ones.
+Changes are detected with inotify when pyinotify is installed, which
+reports them right away, and otherwise by polling the modification times.
+A burst of events (editors often write a file in several steps, or save
+several files at once) is reported once, after things have been quiet for
+a short while.
+"""
+
+import os
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class Watcher(object):
+    """Report modifications to a set of files.
+
+    Parameters
+    ----------
+    expand : callable
+      Returns the list of files to watch.  It is called again whenever the
+      watched directories change, so it can pick up new files.
+
+    paths : list
+      Files and directories whose changes can affect the result of expand.
+      Directories are watched recursively.
+
+    debounce : float
+      Seconds without any new event after which changes are reported.
+
+    interval : float
+      Seconds between checks when polling.
+
+    use_inotify : bool or None
+      Whether to use inotify rather than polling.  By default, inotify is
+      used when pyinotify is installed.
+    """
+
+    def __init__(self, expand, paths, debounce=0.05, interval=0.25,
+                 use_inotify=None):
+        self.expand = expand
+        self.paths = paths
+        self.debounce = debounce
+        self.interval = interval
+        if use_inotify is None:
+            use_inotify = pyinotify is not None
+        self.notifier = None
+        if use_inotify:
+            self._start_inotify()
+        self.snapshot = self._stat_files()
+
+    def _stat_files(self):
+        """Return a dict mapping each watched file to its mtime and size."""
+        snapshot = {}
+        for fname in self.expand():
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            snapshot[fname] = (st.st_mtime, st.st_size)
+        return snapshot
+
+    def _start_inotify(self):
+        self.events = set()
+        events = self.events
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                events.add(event.pathname)
+
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_CREATE)
+        self.manager = pyinotify.WatchManager()
+        for path in self.paths:
+            # Files are watched through their directory, as editors often
+            # replace them rather than write to them
+            if not os.path.isdir(path):
+                path = os.path.dirname(path) or '.'
+            self.manager.add_watch(path, mask, rec=True, auto_add=True)
+        self.notifier = pyinotify.Notifier(self.manager, Handler())
+
+    def _wait_inotify(self, timeout):
+        """Wait for inotify events for up to timeout seconds.
+
+        Returns True if there were any."""
+        if self.notifier.check_events(int(timeout * 1000)):
+            self.notifier.read_events()
+            self.notifier.process_events()
+        if self.events:
+            self.events.clear()
+            return True
+        return False
+
+    def _modified(self):
+        """Return the files modified or created since the last call."""
+        snapshot = self._stat_files()
+        changed = [fname for fname, stat in snapshot.items()
+                   if self.snapshot.get(fname) != stat]
+        self.snapshot = snapshot
+        return sorted(changed)
+
+    def changes(self):
+        """Iterate over the lists of files changed, as they change.
+
+        This never ends, the caller decides when to stop."""
+        while True:
+            if self.notifier is not None:
+                # Block until something happens, then until things settle
+                if not self._wait_inotify(self.interval):
+                    continue
+                while self._wait_inotify(self.debounce):
+                    pass
+                changed = self._modified()
+            else:
+                time.sleep(self.interval)
+                changed = self._modified()
+                # Something is still being written, wait until it's done
+                while changed:
+                    time.sleep(self.debounce)
+                    more = self._modified()
+                    if not more:
+                        break
+                    changed = sorted(set(changed) | set(more))
+            if changed:
+                yield changed
+
+    def close(self):
+        """Stop watching."""
+        if self.notifier is not None:
+            self.notifier.stop()
+            self.notifier = None